@@ -0,0 +1,111 @@
+"""
+Throughput of the feed process -> websocket server hop: multiprocessing.Queue of
+pickled to_dict() payloads versus the shared memory ring buffer.
+
+    python benchmarks/aggregator_transport.py --messages 200000 --producers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from decimal import Decimal
+from queue import Empty
+
+from cryptofeed.types import Trade
+
+sys.path.append(
+    os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "../services/market_data_aggregator")
+    )
+)
+
+from transport import FeedTransport
+
+MARKETS = {"COINBASE": ["BTC-USD", "ETH-USD", "SOL-USD"]}
+
+
+def get_trade(idx: int) -> Trade:
+    return Trade(
+        "COINBASE",
+        MARKETS["COINBASE"][idx % 3],
+        "buy",
+        Decimal("0.015"),
+        Decimal("64123.45"),
+        time.time(),
+        id=str(idx),
+    )
+
+
+def queue_producer(queue: multiprocessing.Queue, messages: int):
+    for idx in range(messages):
+        queue.put({"trades": get_trade(idx).to_dict(numeric_type=float)})
+
+
+def ring_producer(transport: FeedTransport, messages: int):
+    for idx in range(messages):
+        trade = get_trade(idx)
+        while not transport.send_trade(trade):
+            time.sleep(0)
+
+
+def run_queue(messages: int, producers: int) -> float:
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=queue_producer, args=(queue, messages))
+        for _ in range(producers)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    received = 0
+    while received < messages * producers:
+        try:
+            queue.get(timeout=1)
+            received += 1
+        except Empty:
+            pass
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    return elapsed
+
+
+def run_ring(messages: int, producers: int) -> float:
+    transports = [FeedTransport(MARKETS) for _ in range(producers)]
+    processes = [
+        multiprocessing.Process(target=ring_producer, args=(transport, messages))
+        for transport in transports
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    received = 0
+    while received < messages * producers:
+        batch = 0
+        for transport in transports:
+            batch += len(transport.receive())
+        if not batch:
+            time.sleep(0.001)
+        received += batch
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    for transport in transports:
+        transport.close()
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--producers", type=int, default=4)
+    args = parser.parse_args()
+    total = args.messages * args.producers
+    for name, runner in (
+        ("multiprocessing.Queue", run_queue),
+        ("ring buffer", run_ring),
+    ):
+        elapsed = runner(args.messages, args.producers)
+        print(f"{name:>22}: {total / elapsed:>12,.0f} msg/s ({elapsed:.2f}s)")
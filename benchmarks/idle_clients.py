@@ -0,0 +1,134 @@
+"""
+Idle CPU and wake-up latency of the websocket client loops, before (busy polling
+with asyncio.sleep(0) / a fixed 1 ms ring buffer poll) and after (asyncio.Condition
+broadcast / ring buffer wake-up pipe).
+
+    python benchmarks/idle_clients.py --clients 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(
+    os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "../services/market_data_aggregator")
+    )
+)
+
+from transport import END, TRADE, RingBuffer
+
+IDLE_SECONDS = 2
+UPDATES = 100
+UPDATE_INTERVAL = 0.02
+
+
+class PollingScores:
+    def __init__(self):
+        self.version = 0
+        self.updated_tmstmp = None
+
+    async def notify(self):
+        self.version += 1
+        self.updated_tmstmp = time.perf_counter()
+
+    async def client(self, latencies: list):
+        sent_version = self.version
+        while True:
+            if self.version != sent_version:
+                sent_version = self.version
+                latencies.append(time.perf_counter() - self.updated_tmstmp)
+            await asyncio.sleep(0)
+
+
+class BroadcastScores:
+    def __init__(self):
+        self.version = 0
+        self.updated_tmstmp = None
+        self.condition = asyncio.Condition()
+
+    async def notify(self):
+        async with self.condition:
+            self.version += 1
+            self.updated_tmstmp = time.perf_counter()
+            self.condition.notify_all()
+
+    async def client(self, latencies: list):
+        sent_version = self.version
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.version != sent_version)
+            sent_version = self.version
+            latencies.append(time.perf_counter() - self.updated_tmstmp)
+
+
+async def ring_reader(ring: RingBuffer, latencies: list, wake_up: bool):
+    while True:
+        records = ring.read()
+        if not records:
+            if wake_up:
+                await ring.wait(0.05)
+            else:
+                await asyncio.sleep(0.001)
+            continue
+        for record in records:
+            latencies.append(time.perf_counter() - record[4])
+
+
+async def measure(clients: list, notify) -> tuple:
+    tasks = [asyncio.create_task(client) for client in clients]
+    await asyncio.sleep(0.1)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+    for _ in range(UPDATES):
+        await notify()
+        await asyncio.sleep(UPDATE_INTERVAL)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return idle_cpu
+
+
+def report(name: str, idle_cpu: float, latencies: list):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{name:>32}: idle CPU {idle_cpu:6.1%} | latency median "
+        f"{statistics.median(latencies) * 1e3:7.3f} ms, p99 {p99 * 1e3:7.3f} ms"
+    )
+
+
+async def main(client_amount: int):
+    for name, scores_class in (
+        ("screener clients, sleep(0) poll", PollingScores),
+        ("screener clients, Condition", BroadcastScores),
+    ):
+        scores, latencies = scores_class(), list()
+        clients = [scores.client(latencies) for _ in range(client_amount)]
+        report(name, await measure(clients, scores.notify), latencies)
+    for name, wake_up in (
+        ("ring reader, fixed 1 ms poll", False),
+        ("ring reader, wake-up pipe", True),
+    ):
+        ring, latencies = RingBuffer(1024), list()
+
+        async def notify():
+            ring.write([(TRADE, 0, END, 0, time.perf_counter(), 1.0, 0.0, b"", b"")])
+
+        report(
+            name,
+            await measure([ring_reader(ring, latencies, wake_up)], notify),
+            latencies,
+        )
+        ring.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients))
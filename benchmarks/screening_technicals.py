@@ -0,0 +1,156 @@
+"""
+Volume by price and fractal levels: the previous row-wise implementations versus
+the vectorized ones in services/screening/indicators/technicals.py. Outputs are
+compared before timing.
+
+    python benchmarks/screening_technicals.py --sizes 300 5000 50000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "../services/screening"))
+)
+
+from indicators import technicals
+
+
+class RowWiseFractalCandlestickPattern:
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        self.levels = []
+        self.output = []
+
+    def is_support(self, i):
+        cond1 = self.df["low"][i] < self.df["low"][i - 1]
+        cond2 = self.df["low"][i] < self.df["low"][i + 1]
+        cond3 = self.df["low"][i + 1] < self.df["low"][i + 2]
+        cond4 = self.df["low"][i - 1] < self.df["low"][i - 2]
+        return cond1 and cond2 and cond3 and cond4
+
+    def is_resistance(self, i):
+        cond1 = self.df["high"][i] > self.df["high"][i - 1]
+        cond2 = self.df["high"][i] > self.df["high"][i + 1]
+        cond3 = self.df["high"][i + 1] > self.df["high"][i + 2]
+        cond4 = self.df["high"][i - 1] > self.df["high"][i - 2]
+        return cond1 and cond2 and cond3 and cond4
+
+    def is_far_from_level(self, value, levels):
+        ave = np.mean(self.df["high"] - self.df["low"])
+        nearest_levels = [level for _, level in levels if abs(value - level) < ave]
+        return len(nearest_levels) == 0
+
+    def handle_level(self, i: int):
+        level = self.df["high"][i]
+        if self.is_far_from_level(level, self.levels):
+            self.levels.append((i, level))
+            self.output.append(level)
+
+    def run(self):
+        for i in range(2, len(self.df) - 2):
+            if self.is_support(i) or self.is_resistance(i):
+                self.handle_level(i)
+        return self.output
+
+
+def row_wise_get_vbp(ohlcv: pd.DataFrame, periods: int = 30) -> pd.DataFrame:
+    last_close = ohlcv["close"].iloc[-1]
+    ohlcv["volume_type"] = ohlcv.apply(
+        lambda row: "positive" if row["close"] > row["open"] else "negative", axis=1
+    )
+    ohlcv["price_bin"] = pd.qcut(ohlcv["close"], q=periods, duplicates="drop")
+    volume_by_type = (
+        ohlcv.groupby(["price_bin", "volume_type"])["volume"]
+        .sum()
+        .unstack()
+        .fillna(0)
+        .reset_index()
+    )
+    total_volume = ohlcv.groupby("price_bin")["volume"].sum().reset_index()
+    vbp = pd.merge(total_volume, volume_by_type, on="price_bin")
+    vbp["close"] = vbp["price_bin"].apply(lambda x: min(x.left, x.right))
+    vbp["level_type"] = vbp["close"].apply(
+        lambda x: "support" if x < last_close else "resistance"
+    )
+    vbp.drop(columns="price_bin", inplace=True)
+    vbp["volume"] = vbp["negative"] + vbp["positive"]
+    return vbp.sort_values(by="volume", ascending=False)
+
+
+def get_ohlcv(size: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, size)))
+    open_ = close * np.exp(rng.normal(0, 0.01, size))
+    return pd.DataFrame(
+        dict(
+            timestamp=np.arange(size) * 86400.0,
+            open=open_,
+            high=np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.01, size))),
+            low=np.minimum(open_, close) / np.exp(np.abs(rng.normal(0, 0.01, size))),
+            close=close,
+            volume=rng.uniform(1, 1000, size),
+        )
+    )
+
+
+def timeit(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def check_outputs(ohlcv: pd.DataFrame):
+    expected_vbp = row_wise_get_vbp(ohlcv.copy()).reset_index(drop=True)
+    # the row-wise levels come out as a categorical of the bin edges
+    expected_vbp["close"] = expected_vbp["close"].astype(np.float64)
+    pd.testing.assert_frame_equal(
+        expected_vbp,
+        technicals.get_vbp(ohlcv).reset_index(drop=True),
+        check_exact=False,
+        rtol=1e-12,
+    )
+    expected = RowWiseFractalCandlestickPattern(ohlcv).run()
+    assert technicals.FractalCandlestickPattern(ohlcv).run() == expected
+
+
+def run(sizes: list, repeat: int):
+    print(
+        f"{'candles':>8} {'function':>8} {'row-wise':>12} {'vectorized':>12} {'gain':>8}"
+    )
+    for size in sizes:
+        ohlcv = get_ohlcv(size)
+        check_outputs(ohlcv)
+        runs = max(1, repeat * 300 // size)
+        for name, before, after in (
+            (
+                "vbp",
+                lambda: row_wise_get_vbp(ohlcv.copy()),
+                lambda: technicals.get_vbp(ohlcv),
+            ),
+            (
+                "fractals",
+                lambda: RowWiseFractalCandlestickPattern(ohlcv).run(),
+                lambda: technicals.FractalCandlestickPattern(ohlcv).run(),
+            ),
+        ):
+            before_time = timeit(before, runs)
+            after_time = timeit(after, runs * 10)
+            print(
+                f"{size:>8} {name:>8} {before_time * 1e3:>10.2f}ms "
+                f"{after_time * 1e3:>10.3f}ms {before_time / after_time:>7.0f}x"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[300, 5000, 50000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
@@ -1,6 +1,13 @@
+import atexit
+
 from django.apps import AppConfig
 
 
 class CryptoStationConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "crypto_station_api"
+
+    def ready(self):
+        from crypto_station_api.data_sources.ccxt import exchange_pool
+
+        atexit.register(exchange_pool.close)
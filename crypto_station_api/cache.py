@@ -0,0 +1,155 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import django
+import redis
+
+CACHE_MAX_SIZE = 1024
+REDIS_KEY_PREFIX = "response_cache:"
+TTLS = dict(
+    exchanges=86400,
+    markets=3600,
+    ohlc=30,
+    order_book=2,
+    coinmarketcap_mapping=86400,
+    coinmarketcap_meta=3600,
+)
+
+
+class ResponseCache:
+    """
+    TTL cache of response bodies, bounded with LRU eviction. Concurrent misses on
+    the same key share one upstream call, also across the event loops Django may
+    run views on. With a Redis URL, entries are also shared between processes, an
+    unreachable Redis only disables that shared layer.
+    """
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, redis_url: str = None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.in_flight = dict()
+        self.lock = threading.Lock()
+        self.redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+
+    def get_local(self, key: str) -> bytes or None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, content = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return content
+
+    def set_local(self, key: str, content: bytes, ttl: float):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, content)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    async def get_shared(self, key: str) -> bytes or None:
+        if self.redis_client is None:
+            return None
+        try:
+            return await asyncio.to_thread(
+                self.redis_client.get, REDIS_KEY_PREFIX + key
+            )
+        except redis.RedisError:
+            return None
+
+    async def set_shared(self, key: str, content: bytes, ttl: float):
+        if self.redis_client is None:
+            return
+        try:
+            await asyncio.to_thread(
+                self.redis_client.set, REDIS_KEY_PREFIX + key, content, ex=int(ttl)
+            )
+        except redis.RedisError:
+            pass
+
+    async def fetch(self, key: str, ttl: float, get_content) -> bytes:
+        while True:
+            content = self.get_local(key)
+            if content is not None:
+                return content
+            with self.lock:
+                future = self.in_flight.get(key)
+                is_leader = future is None
+                if is_leader:
+                    future = self.in_flight[key] = Future()
+            if is_leader:
+                return await self.fetch_as_leader(key, ttl, get_content, future)
+            try:
+                # shielded, so that a cancelled follower leaves the shared call alone
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the leader was cancelled, the next round elects a new one
+
+    async def fetch_as_leader(
+        self, key: str, ttl: float, get_content, future: Future
+    ) -> bytes:
+        try:
+            content = await self.get_shared(key)
+            if content is None:
+                content = await get_content()
+                await self.set_shared(key, content, ttl)
+            self.set_local(key, content, ttl)
+            if not future.done():
+                future.set_result(content)
+            return content
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+
+class UncachedResponse(Exception):
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+response_cache = ResponseCache(redis_url=os.getenv("RESPONSE_CACHE_REDIS_URL"))
+
+
+def cached_response(ttl: float):
+    """
+    Caches the body of successful JSON views, keyed by view and query string
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            key = f"{view.__name__}?{request.GET.urlencode()}"
+
+            async def get_content() -> bytes:
+                response = await view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    raise UncachedResponse(response)
+                return response.content
+
+            try:
+                content = await response_cache.fetch(key, ttl, get_content)
+            except UncachedResponse as e:
+                return e.response
+            return django.http.HttpResponse(content, content_type="application/json")
+
+        return wrapper
+
+    return decorator
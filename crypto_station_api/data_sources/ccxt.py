@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+from utils.helpers import get_exchange_object
+
+CLOSE_TIMEOUT = 10
+
+
+class ExchangePool:
+    """
+    Long-lived ccxt clients, one per exchange id, with markets loaded once and HTTP
+    sessions reused across requests. The async clients live on a dedicated event
+    loop thread: Django may run each async view on its own short-lived loop, while
+    an aiohttp session is bound to the loop it was created on.
+    """
+
+    def __init__(self):
+        self.exchanges = dict()
+        self.async_exchanges = dict()
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(
+                    target=self.loop.run_forever, name="exchange-pool", daemon=True
+                )
+                self.thread.start()
+            return self.loop
+
+    def get_exchange(self, exchange_id: str):
+        with self.lock:
+            if exchange_id not in self.exchanges:
+                self.exchanges[exchange_id] = get_exchange_object(
+                    exchange_id, async_mode=False
+                )
+            exchange = self.exchanges[exchange_id]
+        exchange.load_markets()
+        return exchange
+
+    async def get_async_exchange(self, exchange_id: str):
+        if exchange_id not in self.async_exchanges:
+            self.async_exchanges[exchange_id] = get_exchange_object(
+                exchange_id, async_mode=True
+            )
+        exchange = self.async_exchanges[exchange_id]
+        await exchange.load_markets()
+        return exchange
+
+    async def call(self, exchange_id: str, method: str, *args, **kwargs):
+        """
+        Awaits `method` of the pooled async client for `exchange_id`, from any loop
+        """
+
+        async def run_on_pool_loop():
+            exchange = await self.get_async_exchange(exchange_id)
+            return await getattr(exchange, method)(*args, **kwargs)
+
+        future = asyncio.run_coroutine_threadsafe(run_on_pool_loop(), self.get_loop())
+        return await asyncio.wrap_future(future)
+
+    async def close_async_exchanges(self):
+        exchanges = list(self.async_exchanges.values())
+        self.async_exchanges.clear()
+        await asyncio.gather(
+            *[exchange.close() for exchange in exchanges], return_exceptions=True
+        )
+
+    def close(self):
+        with self.lock:
+            loop, thread = self.loop, self.thread
+            self.loop = self.thread = None
+            exchanges = list(self.exchanges.values())
+            self.exchanges.clear()
+        for exchange in exchanges:
+            session = getattr(exchange, "session", None)
+            if session is not None:
+                session.close()
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.close_async_exchanges(), loop).result(
+                CLOSE_TIMEOUT
+            )
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(CLOSE_TIMEOUT)
+            loop.close()
+
+
+exchange_pool = ExchangePool()
@@ -1,21 +1,27 @@
 import json
 import uuid
 from datetime import datetime as dt
+from functools import partial
 
 import ccxt
 import django
 from asgiref.sync import sync_to_async
 from ccxt.base import errors
+from django.forms.models import model_to_dict
 from django.views.decorators.csrf import csrf_exempt
 from GoogleNews import GoogleNews
 from rest_framework import viewsets
 
+from crypto_station_api.cache import TTLS, cached_response
+from crypto_station_api.data_sources.ccxt import exchange_pool
 from crypto_station_api.data_sources.coinmarketcap import CoinMarketCap
 from crypto_station_api.models import Orders, Trades
 from crypto_station_api.serializers import OrdersSerializer, TradesSerializer
-from utils.helpers import get_exchange_object
+from utils.ohlcv_cache import OhlcvCache
+from utils.order_events import CANCELLED_ORDER, NEW_ORDER, order_events
 
 coinmarketcap = CoinMarketCap()
+ohlcv_cache = OhlcvCache()
 
 
 @csrf_exempt
@@ -32,38 +38,44 @@ def login_view(request: django.core.handlers.wsgi.WSGIRequest):
         return django.http.HttpResponseForbidden()
 
 
+@cached_response(TTLS["exchanges"])
 async def get_exchanges(request: django.core.handlers.wsgi.WSGIRequest):
     data = ccxt.exchanges
     return django.http.JsonResponse(data, safe=False)
 
 
+@cached_response(TTLS["ohlc"])
 async def get_ohlc(request: django.core.handlers.wsgi.WSGIRequest):
     exchange = request.GET.get("exchange")
     timeframe = request.GET.get("timeframe")
     pair = request.GET.get("pair")
-    exchange = get_exchange_object(exchange, async_mode=True)
     try:
-        ohlc_data = await exchange.fetch_ohlcv(
-            symbol=pair, timeframe=timeframe, limit=300
+        ohlc_data = await ohlcv_cache.fetch(
+            partial(exchange_pool.call, exchange, "fetch_ohlcv"),
+            exchange,
+            pair,
+            timeframe=timeframe,
+            limit=300,
         )
     except errors.BadSymbol:
         ohlc_data = None
-    await exchange.close()
     return django.http.JsonResponse(ohlc_data, safe=False)
 
 
+@cached_response(TTLS["order_book"])
 async def get_order_book(request: django.core.handlers.wsgi.WSGIRequest):
     exchange = request.GET.get("exchange")
     pair = request.GET.get("pair")
-    exchange = get_exchange_object(exchange, async_mode=True)
     try:
-        order_book_data = await exchange.fetch_order_book(symbol=pair, limit=10000)
+        order_book_data = await exchange_pool.call(
+            exchange, "fetch_order_book", symbol=pair, limit=10000
+        )
     except:
         order_book_data = None
-    await exchange.close()
     return django.http.JsonResponse(order_book_data, safe=False)
 
 
+@cached_response(TTLS["coinmarketcap_mapping"])
 async def get_asset_coinmarketcap_mapping(
     request: django.core.handlers.wsgi.WSGIRequest,
 ):
@@ -75,6 +87,7 @@ async def get_asset_coinmarketcap_mapping(
     )
 
 
+@cached_response(TTLS["coinmarketcap_meta"])
 async def get_crypto_meta_data(request: django.core.handlers.wsgi.WSGIRequest):
     crypto_coinmarketcap_id = request.GET.get("crypto_coinmarketcap_id")
     return django.http.JsonResponse(
@@ -87,10 +100,11 @@ async def get_crypto_meta_data(request: django.core.handlers.wsgi.WSGIRequest):
     )
 
 
+@cached_response(TTLS["markets"])
 async def get_exchange_markets(request: django.core.handlers.wsgi.WSGIRequest):
     exchange = request.GET.get("exchange")
-    exchange = get_exchange_object(exchange, async_mode=False)
-    return django.http.JsonResponse(exchange.load_markets(), safe=False)
+    markets = await exchange_pool.call(exchange, "load_markets")
+    return django.http.JsonResponse(markets, safe=False)
 
 
 async def get_news(request: django.core.handlers.wsgi.WSGIRequest):
@@ -109,7 +123,7 @@ async def get_news(request: django.core.handlers.wsgi.WSGIRequest):
 def get_public_trades(request: django.core.handlers.wsgi.WSGIRequest):
     exchange = request.GET.get("exchange")
     pair = request.GET.get("pair")
-    exchange = get_exchange_object(exchange, async_mode=False)
+    exchange = exchange_pool.get_exchange(exchange)
     try:
         data = exchange.fetch_trades(symbol=pair, limit=1000)
     except errors.BadSymbol:
@@ -140,6 +154,7 @@ async def post_new_order(request: django.core.handlers.wsgi.WSGIRequest):
         insert_tmstmp=dt.now(),
     )
     await sync_to_async(new_order.save)()
+    await sync_to_async(order_events.publish)(NEW_ORDER, model_to_dict(new_order))
     return django.http.JsonResponse("success", safe=False)
 
 
@@ -148,6 +163,9 @@ async def cancel_order(request: django.core.handlers.wsgi.WSGIRequest):
     data = json.loads(request.body.decode("utf-8"))
     order_dim_key = data.get("order_dim_key")
     order = Orders.objects.filter(order_dim_key=order_dim_key)
+    cancelled_order = await sync_to_async(
+        order.values("order_id", "user_id", "broker_id", "asset_id").first
+    )()
     await sync_to_async(order.update)(expiration_tmstmp=dt.now())
     new_row = Orders(
         order_dim_key=str(uuid.uuid4()),
@@ -167,6 +185,8 @@ async def cancel_order(request: django.core.handlers.wsgi.WSGIRequest):
         insert_tmstmp=dt.now(),
     )
     await sync_to_async(new_row.save)()
+    if cancelled_order:
+        await sync_to_async(order_events.publish)(CANCELLED_ORDER, cancelled_order)
     return django.http.JsonResponse("success", safe=False)
 
 
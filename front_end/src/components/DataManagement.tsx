@@ -273,6 +273,9 @@ function LoadNews(coinMarketCapMapping: any) {
 
 function LoadScreeningData() {
   const dispatch = useDispatch()
+  const selectedExchange = useSelector(
+    (state: { filters: FilterState }) => state.filters.exchange,
+  )
   const selectedPair = useSelector(
     (state: { filters: FilterState }) => state.filters.pair,
   )
@@ -280,6 +283,7 @@ function LoadScreeningData() {
   useEffect(() => {
     const wsUrl = 'ws://localhost:8795'
     const socket = new WebSocket(wsUrl)
+    const scoreRows = new Map<string, any>()
     socket.onerror = () => {
       console.error('Error with screening service')
       setScreeningData(false)
@@ -289,8 +293,21 @@ function LoadScreeningData() {
       setScreeningData([])
     }
     socket.onmessage = (event) => {
-      const formattedData = JSON.parse(event.data)
-      setScreeningData(formattedData)
+      const newData = JSON.parse(event.data)
+      if ('snapshot' in newData) {
+        scoreRows.clear()
+        newData.snapshot.forEach((row: any) => {
+          scoreRows.set(`${row.exchange}:${row.pair}`, row)
+        })
+      } else {
+        newData.changed.forEach((row: any) => {
+          scoreRows.set(`${row.exchange}:${row.pair}`, row)
+        })
+        newData.removed.forEach((key: string) => {
+          scoreRows.delete(key)
+        })
+      }
+      setScreeningData(Array.from(scoreRows.values()))
     }
     return () => {
       if (socket.readyState === 1) {
@@ -302,12 +319,15 @@ function LoadScreeningData() {
   useEffect(() => {
     if (screeningData.length > 0) {
       screeningData.forEach((pairDetails: any) => {
-        if (pairDetails.pair === selectedPair) {
+        if (
+          pairDetails.exchange === selectedExchange &&
+          pairDetails.pair === selectedPair
+        ) {
           dispatch(filterSlice.actions.setPairScoreDetails(pairDetails))
         }
       })
     }
-  }, [selectedPair, JSON.stringify(screeningData)])
+  }, [selectedExchange, selectedPair, screeningData])
 
   return screeningData
 }
@@ -473,7 +493,7 @@ function LoadOrderBook(throtle: number = 500) {
   }
 
   useEffect(() => {
-    const wsUrl = `ws://localhost:8768?exchange=${exchange}?book=${pair.replace('/', '-')}`
+    const wsUrl = `ws://localhost:8768?exchange=${exchange}?book=${pair.replace('/', '-')}?depth=100?conflate_ms=${throtle}`
     const socket = new WebSocket(wsUrl)
 
     socket.onerror = () => {
@@ -485,14 +505,42 @@ function LoadOrderBook(throtle: number = 500) {
     socket.onopen = () => {
       clearInterval(orderBookInterval)
     }
+    let localBook: any = { bid: {}, ask: {}, sequence: null }
     socket.onmessage = (event) => {
       if (event.data != 'heartbeat') {
+        const newData = JSON.parse(event.data)
+        if (Object.keys(newData).includes('book')) {
+          localBook = {
+            bid: { ...newData.book.book.bid },
+            ask: { ...newData.book.book.ask },
+            sequence: newData.book.sequence,
+          }
+        } else if (Object.keys(newData).includes('book_delta')) {
+          const delta = newData.book_delta
+          if (localBook.sequence === null) {
+            return
+          }
+          if (delta.sequence !== localBook.sequence + 1) {
+            localBook.sequence = null
+            socket.send(JSON.stringify({ snapshot: [delta.symbol] }))
+            return
+          }
+          ;['bid', 'ask'].forEach((side: string) => {
+            Object.entries(delta.delta[side]).forEach(([price, size]) => {
+              if (size === 0) {
+                delete localBook[side][price]
+              } else {
+                localBook[side][price] = size
+              }
+            })
+          })
+          localBook.sequence = delta.sequence
+        } else {
+          return
+        }
         if (Date.now() - lastRefreshTmtstmp > throtle) {
           lastRefreshTmtstmp = Date.now()
-          const newData = JSON.parse(event.data)
-          if (Object.keys(newData).includes('book')) {
-            setOrderBookData(formatOrderBook(newData.book.book, true))
-          }
+          setOrderBookData(formatOrderBook(localBook, true))
         }
       }
     }
@@ -29,6 +29,7 @@ function Screening(data: { tradingData: tradingDataDef }) {
   }
 
   const [columnDefs] = useState<ColDef[]>([
+    { field: 'exchange' },
     { field: 'pair' },
     { field: 'close', hide: true },
     {
@@ -188,13 +189,15 @@ function Screening(data: { tradingData: tradingDataDef }) {
 
   const handleClick = (clickedPair: RowClickedEvent<any>) => {
     const pairDetails = clickedPair.data
+    dispatch(filterSlice.actions.setExchange(pairDetails.exchange))
     dispatch(filterSlice.actions.setPair(pairDetails.pair))
     dispatch(filterSlice.actions.setPairScoreDetails(pairDetails))
     dispatch(filterSlice.actions.setSelectedOrder(['', '', '']))
   }
 
   const getRowId = useMemo<GetRowIdFunc>(() => {
-    return (params: GetRowIdParams) => params.data.pair
+    return (params: GetRowIdParams) =>
+      `${params.data.exchange}:${params.data.pair}`
   }, [])
 
   function clearAllFilters(event: any) {
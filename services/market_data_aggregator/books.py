@@ -0,0 +1,61 @@
+import heapq
+
+from cryptofeed.defines import ASK, BID
+
+
+class LocalBook:
+    """
+    Server side copy of an L2 book. Level changes are accumulated until the end of
+    a feed update and then published as one delta with the next sequence number.
+    """
+
+    def __init__(self, exchange: str, symbol: str):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.sides = {BID: dict(), ASK: dict()}
+        self.changes = {BID: dict(), ASK: dict()}
+        self.sequence = 0
+        self.timestamp = None
+        self.is_snapshot = False
+
+    def reset(self):
+        for side in (BID, ASK):
+            self.sides[side].clear()
+            self.changes[side].clear()
+        self.is_snapshot = True
+
+    def update(self, side: str, price: float, size: float):
+        if size:
+            self.sides[side][price] = size
+        else:
+            self.sides[side].pop(price, None)
+        self.changes[side][price] = size
+
+    def get_sorted_side(self, side: str, depth: int = None) -> dict:
+        levels = self.sides[side].items()
+        if depth:
+            select = heapq.nlargest if side == BID else heapq.nsmallest
+            return dict(select(depth, levels))
+        return dict(sorted(levels, reverse=side == BID))
+
+    def snapshot(self, depth: int = None) -> dict:
+        return dict(
+            exchange=self.exchange,
+            symbol=self.symbol,
+            book={side: self.get_sorted_side(side, depth) for side in (BID, ASK)},
+            sequence=self.sequence,
+            timestamp=self.timestamp,
+        )
+
+    def flush(self, timestamp: float) -> dict:
+        self.sequence += 1
+        self.timestamp = timestamp
+        delta = dict(
+            exchange=self.exchange,
+            symbol=self.symbol,
+            delta=self.changes,
+            sequence=self.sequence,
+            timestamp=timestamp,
+        )
+        self.changes = {BID: dict(), ASK: dict()}
+        return delta
@@ -0,0 +1,42 @@
+import heapq
+
+MIN_SYMBOL_WEIGHT = 0.01
+
+
+def partition_markets(markets: dict, weights: dict, process_amount: int) -> list:
+    """
+    Greedy longest-processing-time assignment: heaviest symbols first, each one to
+    the currently lightest process. Every symbol of `markets` is assigned once.
+    """
+    symbols = sorted(
+        (
+            (max(weights.get((exchange, pair), 1), MIN_SYMBOL_WEIGHT), exchange, pair)
+            for exchange, pairs in markets.items()
+            for pair in pairs
+        ),
+        reverse=True,
+    )
+    process_amount = max(1, min(process_amount, len(symbols)))
+    partitions = [dict() for _ in range(process_amount)]
+    loads = [(0, idx) for idx in range(process_amount)]
+    for weight, exchange, pair in symbols:
+        load, idx = heapq.heappop(loads)
+        partitions[idx].setdefault(exchange, list()).append(pair)
+        heapq.heappush(loads, (load + weight, idx))
+    return [partition for partition in partitions if partition]
+
+
+def get_partition_loads(partitions: list, weights: dict) -> list:
+    return [
+        sum(
+            max(weights.get((exchange, pair), 1), MIN_SYMBOL_WEIGHT)
+            for exchange, pairs in partition.items()
+            for pair in pairs
+        )
+        for partition in partitions
+    ]
+
+
+def get_load_skew(loads: list) -> float:
+    mean_load = sum(loads) / len(loads) if loads else 0
+    return max(loads) / mean_load if mean_load else 1
@@ -1,11 +1,10 @@
 import asyncio
 import json
-import math
 import multiprocessing
 import os
+import stat
 import sys
-from datetime import datetime as dt
-from queue import Empty
+import time
 
 import websockets
 from cryptofeed import FeedHandler
@@ -15,9 +14,12 @@ from dotenv import load_dotenv
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
+from books import LocalBook
+from partitioning import get_load_skew, get_partition_loads, partition_markets
+from subscriptions import SubscriptionRegistry, SubscriptionSnapshot
+from transport import BOOK, END, SIDES, SNAPSHOT, TRADE, FeedTransport
 from utils import helpers
 
-
 BASE_CONFIG = {
     "log": {"filename": "demo.log", "level": "DEBUG", "disabled": True},
     "backend_multiprocessing": True,
@@ -25,6 +27,33 @@ BASE_CONFIG = {
 load_dotenv(verbose=True)
 
 WS_PORT = 8768
+TRANSPORT_MAX_WAIT = 0.05
+FEED_WARM_UP = 15
+BOOK_RETRY_INTERVAL = 1
+REBALANCE_MIN_GAIN = 0.9
+WIRE_FORMATS = ("json", "msgpack")
+CLOSE_NORMAL = 1000
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def release_inherited_sockets():
+    """
+    Points every socket descriptor a forked feed process inherited, the server's
+    listening and client sockets included, at /dev/null. Otherwise a client socket
+    the server closes stays open until the feed process exits. The descriptor
+    numbers stay taken, so collecting the inherited socket objects closes nothing
+    the feed process opened.
+    """
+    if not os.path.isdir("/dev/fd"):
+        return
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in map(int, os.listdir("/dev/fd")):
+        try:
+            if fd != devnull and stat.S_ISSOCK(os.fstat(fd).st_mode):
+                os.dup2(devnull, fd)
+        except OSError:
+            pass
+    os.close(devnull)
 
 
 class MarketDataAggregator:
@@ -34,6 +63,9 @@ class MarketDataAggregator:
         pairs: list = None,
         ref_currency: str = None,
         max_cpu_amount: int = None,
+        symbol_weights: dict = None,
+        rebalance_interval: int = 300,
+        max_load_skew: float = 1.5,
     ):
         self.cpu_amount = (
             max_cpu_amount if max_cpu_amount else multiprocessing.cpu_count() - 1
@@ -46,9 +78,24 @@ class MarketDataAggregator:
         self.pairs = pairs
         self.ref_currency = ref_currency
         self.markets = self.get_markets()
-        self.clients = list()
-        self.client_queue = multiprocessing.Queue()
-        self.client_data_queue = multiprocessing.Queue()
+        self.symbol_weights = {
+            (exchange, pair): weight
+            for exchange, pair_weights in (symbol_weights or dict()).items()
+            for pair, weight in pair_weights.items()
+        }
+        self.rebalance_interval = rebalance_interval
+        self.max_load_skew = max_load_skew
+        self.weights_tmstmp = time.monotonic()
+        self.clients = dict()
+        self.closing_tasks = set()
+        self.subscriptions = SubscriptionRegistry()
+        self.subscription_snapshot = SubscriptionSnapshot()
+        self.feeds = dict()
+        self.transport = None
+        self.synced_books = dict()
+        self.book_retry_tmstmps = dict()
+        self.books = dict()
+        self.warming_books = dict()
         self.add_all_feeds()
 
     @staticmethod
@@ -77,44 +124,36 @@ class MarketDataAggregator:
         return markets
 
     def break_down_pairs_per_cpu(self) -> list:
-        total_amount_of_pairs = 0
-        for pairs in self.markets.values():
-            total_amount_of_pairs += len(pairs)
-        symbols_per_process = math.ceil(total_amount_of_pairs / self.cpu_amount)
-        current_sub_dict = dict()
-        sub_lists = list()
-        for exchange, exchange_pairs in self.markets.items():
-            for pair in exchange_pairs:
-                if exchange not in current_sub_dict:
-                    current_sub_dict[exchange] = list()
-                total_amount_of_pairs = sum(
-                    len(values) for values in current_sub_dict.values()
-                )
-                if total_amount_of_pairs <= symbols_per_process:
-                    current_sub_dict[exchange].append(pair)
-                else:
-                    sub_lists.append(current_sub_dict)
-                    current_sub_dict = dict()
-        sub_lists.append(current_sub_dict)
-        return sub_lists
-
-    async def _callback(self, method: str, data):
-        try:
-            queue_data = self.client_queue.get(block=False, timeout=0.01)
-        except Empty:
-            return
-        self.client_queue.put(queue_data)
-        self.client_data_queue.put({method: data.to_dict(numeric_type=float)})
+        return partition_markets(self.markets, self.symbol_weights, self.cpu_amount)
 
     async def book_callback(self, data, tmstmp: float):
-        await self._callback(method="book", data=data)
+        self.transport.count(data)
+        key = (data.exchange, "book", data.symbol)
+        generation = self.subscription_snapshot.get_generation(key)
+        if generation is None:
+            self.synced_books.pop(key, None)
+            return
+        # the server forgets a book once unsubscribed, resubscribing needs a snapshot
+        snapshot = data.delta is None or self.synced_books.get(key) != generation
+        # a book that did not fit in the ring is resent at most once per interval
+        if snapshot and time.monotonic() < self.book_retry_tmstmps.get(key, 0):
+            return
+        if self.transport.send_book(data, snapshot):
+            self.synced_books[key] = generation
+        else:
+            self.synced_books.pop(key, None)
+            self.book_retry_tmstmps[key] = time.monotonic() + BOOK_RETRY_INTERVAL
 
     async def trades_callback(self, data, tmstmp: float):
-        await self._callback(method="trades", data=data)
+        self.transport.count(data)
+        if (data.exchange, "trades", data.symbol) in self.subscription_snapshot.get():
+            self.transport.send_trade(data)
 
-    def run_process(self, markets: dict):
+    def run_process(self, markets: dict, transport: FeedTransport):
         # https://stackoverflow.com/questions/3288595/multiprocessing-how-to-use-pool-map-on-a-function-defined-in-a-class
         multiprocessing.current_process().daemon = False
+        release_inherited_sockets()
+        self.transport = transport
         f = FeedHandler()
         for exchange, exchange_pairs in markets.items():
             feed_config = self.get_feed_config(exchange)
@@ -131,21 +170,200 @@ class MarketDataAggregator:
             )
         f.run()
 
+    def start_feed(self, markets: dict) -> tuple:
+        transport = FeedTransport(markets)
+        process = multiprocessing.Process(
+            target=self.run_process, args=(markets, transport)
+        )
+        process.start()
+        return transport, process
+
     def add_all_feeds(self):
-        sub_markets = self.break_down_pairs_per_cpu()
-        processes = list()
-        for markets in sub_markets:
-            process = multiprocessing.Process(target=self.run_process, args=(markets,))
-            processes.append(process)
-            process.start()
+        for markets in self.break_down_pairs_per_cpu():
+            transport, process = self.start_feed(markets)
+            self.feeds[transport] = process
+
+    def update_symbol_weights(self):
+        now = time.monotonic()
+        elapsed = now - self.weights_tmstmp
+        self.weights_tmstmp = now
+        for transport in self.feeds:
+            counts = transport.message_counts[:]
+            for symbol, count, last_count in zip(
+                transport.symbols, counts, transport.last_counts
+            ):
+                self.symbol_weights[symbol] = (count - last_count) / elapsed
+            transport.last_counts = counts
+
+    async def rebalance_feeds(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.rebalance_interval)
+            self.update_symbol_weights()
+            loads = get_partition_loads(
+                [transport.markets for transport in self.feeds], self.symbol_weights
+            )
+            partitions = self.break_down_pairs_per_cpu()
+            new_loads = get_partition_loads(partitions, self.symbol_weights)
+            skew = get_load_skew(loads)
+            if (
+                skew <= self.max_load_skew
+                or max(new_loads) >= max(loads) * REBALANCE_MIN_GAIN
+            ):
+                continue
+            print(
+                f"Rebalancing {len(partitions)} feed processes (load skew {skew:.2f})"
+            )
+            # Fork from a worker thread so children do not inherit the running loop
+            new_feeds = [
+                await loop.run_in_executor(None, self.start_feed, markets)
+                for markets in partitions
+            ]
+            for transport, _ in new_feeds:
+                transport.is_warming = True
+                self.warming_books[transport] = dict()
+                loop.create_task(self.read_transport(transport))
+            await asyncio.sleep(FEED_WARM_UP)
+            old_feeds = self.feeds
+            self.feeds = dict(new_feeds)
+            for transport in old_feeds:
+                transport.is_retired = True
+            await self.cut_over_books(list(self.feeds))
+            for process in old_feeds.values():
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+
+    async def cut_over_books(self, transports: list):
+        """
+        Switches to the books the warmed up feeds built on their own and publishes
+        them as snapshots, continuing the sequence of the books they replace. Runs
+        without awaiting until every snapshot is queued, so no record of the new
+        feeds is handled in between.
+        """
+        slow_sessions = set()
+        for transport in transports:
+            transport.is_warming = False
+            for key, book in self.warming_books.pop(transport).items():
+                old_book = self.books.get(key)
+                if old_book is not None:
+                    book.sequence = max(book.sequence, old_book.sequence) + 1
+                book.is_snapshot = False
+                self.books[key] = book
+                slow_sessions.update(
+                    self.subscriptions.publish("book", book.snapshot())
+                )
+        for session_id in slow_sessions:
+            self.drop_slow_client(session_id)
 
     async def send_to_aggregator_process(
         self, websocket, session_id: str, params: dict
+    ) -> asyncio.Queue:
+        print(f"New session: {websocket.id} with parameters: {params}")
+        self.clients[session_id] = websocket
+        client_queue = self.subscriptions.subscribe(session_id, params)
+        self.publish_subscriptions()
+        await self.send_book_snapshots(session_id)
+        return client_queue
+
+    async def send_book_snapshots(self, session_id: str, symbols: list = None):
+        symbols = [symbol.upper() for symbol in symbols] if symbols else None
+        for key in self.subscriptions.session_keys[session_id]:
+            exchange, method, symbol = key
+            book = self.books.get((exchange, symbol))
+            if method == "book" and book and (not symbols or symbol in symbols):
+                if session_id in self.subscriptions.book_views:
+                    self.subscriptions.mark_dirty(session_id, key)
+                elif not self.subscriptions.send(session_id, "book", book.snapshot()):
+                    self.drop_slow_client(session_id)
+                    return
+
+    async def send_book_views(self, session_id: str):
+        view = self.subscriptions.book_views[session_id]
+        while session_id in self.subscriptions.book_views:
+            dirty_books = await self.subscriptions.get_dirty_books(session_id)
+            for exchange, _, symbol in dirty_books:
+                book = self.books.get((exchange, symbol))
+                if book is None:
+                    continue
+                snapshot = book.snapshot(view["depth"])
+                if not self.subscriptions.send(session_id, "book", snapshot):
+                    self.drop_slow_client(session_id)
+                    return
+            await asyncio.sleep(view["conflate_ms"] / 1000)
+
+    async def receive_from_client(self, session_id: str, websocket):
+        try:
+            async for message in websocket:
+                try:
+                    request = json.loads(message)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(request, dict) or session_id not in self.clients:
+                    continue
+                if "snapshot" in request:
+                    await self.send_book_snapshots(session_id, request["snapshot"])
+                if "subscribe" in request or "unsubscribe" in request:
+                    await self.update_client_keys(session_id, request)
+        except websockets.exceptions.ConnectionClosed:
+            return
+
+    @staticmethod
+    def get_request_methods(methods) -> dict:
+        if not isinstance(methods, dict):
+            return dict()
+        return {
+            method: [pair for pair in pairs if isinstance(pair, str)]
+            for method, pairs in methods.items()
+            if method in ("book", "trades") and isinstance(pairs, list)
+        }
+
+    async def update_client_keys(self, session_id: str, request: dict):
+        """
+        Changes the symbols of a running session, e.g.
+        {"subscribe": {"trades": ["btc-usd"]}, "unsubscribe": {"book": ["eth-usd"]}},
+        for each exchange of the session. New book keys get a snapshot first.
+        """
+        self.subscriptions.remove_keys(
+            session_id, self.get_request_methods(request.get("unsubscribe"))
+        )
+        keys = self.subscriptions.add_keys(
+            session_id, self.get_request_methods(request.get("subscribe"))
+        )
+        self.publish_subscriptions()
+        book_symbols = [symbol for _, method, symbol in keys if method == "book"]
+        if book_symbols:
+            await self.send_book_snapshots(session_id, book_symbols)
+
+    def publish_subscriptions(self):
+        """
+        Shares the subscribed keys with the feeds and forgets the books left without
+        subscribers, which stop receiving updates
+        """
+        keys = self.subscriptions.keys()
+        self.subscription_snapshot.publish(keys)
+        for books in (self.books, *self.warming_books.values()):
+            for exchange, symbol in list(books):
+                if (exchange, "book", symbol) not in keys:
+                    del books[(exchange, symbol)]
+
+    def remove_client(
+        self, session_id: str, code: int = CLOSE_NORMAL, reason: str = ""
     ):
-        if session_id not in self.clients:
-            self.clients.append(session_id)
-            print(f"New session: {websocket.id} with parameters: {params}")
-            self.client_queue.put(session_id)
+        """
+        Unsubscribes the session right away, its socket is closed in the background so
+        the close handshake does not hold up the caller
+        """
+        websocket = self.clients.pop(session_id, None)
+        self.subscriptions.unsubscribe(session_id)
+        self.publish_subscriptions()
+        if websocket:
+            task = asyncio.create_task(websocket.close(code, reason))
+            self.closing_tasks.add(task)
+            task.add_done_callback(self.closing_tasks.discard)
+
+    def drop_slow_client(self, session_id: str):
+        print(f"Session {session_id} dropped (outbound buffer full)")
+        self.remove_client(session_id, CLOSE_TRY_AGAIN_LATER, "outbound buffer full")
 
     @staticmethod
     def get_ws_parameters(path: str) -> dict:
@@ -154,7 +372,9 @@ class MarketDataAggregator:
         validation = dict(exchange=False, method=False)
         for param in params:
             if param:
-                param_name, param_value = param.split("=")
+                param_name, separator, param_value = param.partition("=")
+                if not separator:
+                    return None
                 param_value = param_value.split(",")
                 if param_name == "exchange":
                     validation["exchange"] = True
@@ -162,60 +382,136 @@ class MarketDataAggregator:
                 elif param_name in ("book", "trades") and param_value:
                     formatted_param["methods"][param_name] = param_value
                     validation["method"] = True
+                elif param_name in ("depth", "conflate_ms"):
+                    if not param_value[0].isdigit():
+                        return None
+                    formatted_param[param_name] = int(param_value[0])
+                elif param_name == "format" and param_value[0] in WIRE_FORMATS:
+                    formatted_param[param_name] = param_value[0]
         is_validated = all(value for value in validation.values())
         if is_validated:
             return formatted_param
 
-    async def send_to_client(self, websocket, params: dict):
-        while True:
-            try:
-                queue_data = self.client_data_queue.get(block=False, timeout=1)
-                for method, details in queue_data.items():
-                    if (
-                        method in params["methods"]
-                        and params["exchange"][0].upper() == details["exchange"]
-                        and details["symbol"].upper()
-                        in [pair.upper() for pair in params["methods"][method]]
-                    ):
-                        await websocket.send(json.dumps(queue_data, default=str))
-            except Empty:
+    async def publish(self, method: str, details: dict, channel: str = None):
+        slow_sessions = self.subscriptions.publish(method, details, channel)
+        for session_id in slow_sessions:
+            self.drop_slow_client(session_id)
+
+    async def handle_trade_record(self, exchange: str, symbol: str, record: tuple):
+        _, side, _, _, price, amount, timestamp, trade_id, trade_type = record
+        await self.publish(
+            "trades",
+            dict(
+                exchange=exchange,
+                symbol=symbol,
+                side=SIDES[TRADE][side],
+                amount=amount,
+                price=price,
+                id=FeedTransport.decode_text(trade_id),
+                type=FeedTransport.decode_text(trade_type),
+                timestamp=timestamp,
+            ),
+        )
+
+    async def handle_book_record(
+        self, exchange: str, symbol: str, record: tuple, books: dict
+    ):
+        """
+        Applies a book record to `books`, published only for the live books
+        """
+        _, side, flags, _, price, size, timestamp, _, _ = record
+        key = (exchange, symbol)
+        if key not in books:
+            # updates of a book forgotten on unsubscribing, until its next snapshot
+            if not flags & SNAPSHOT:
+                return
+            books[key] = LocalBook(exchange, symbol)
+        book = books[key]
+        if flags & SNAPSHOT:
+            book.reset()
+        book.update(SIDES[BOOK][side], price, size)
+        if flags & END:
+            delta = book.flush(timestamp)
+            if books is not self.books:
                 return
+            if book.is_snapshot:
+                book.is_snapshot = False
+                await self.publish("book", book.snapshot())
+            else:
+                await self.publish("book_delta", delta, channel="book")
 
-    async def empty_queue(self):
-        while True:
-            try:
-                self.client_queue.get(block=False, timeout=0.01)
-            except Empty:
-                break
+    async def handle_records(self, transport: FeedTransport, records: list):
+        for record in records:
+            # records of retired feeds would duplicate or go back on the new feeds
+            if transport.is_retired:
+                return
+            exchange, symbol = transport.symbols[record[3]]
+            if record[0] == TRADE:
+                if not transport.is_warming:
+                    await self.handle_trade_record(exchange, symbol, record)
+            elif transport.is_warming:
+                await self.handle_book_record(
+                    exchange, symbol, record, self.warming_books[transport]
+                )
+            else:
+                await self.handle_book_record(exchange, symbol, record, self.books)
+
+    async def read_transport(self, transport: FeedTransport):
+        while not transport.is_retired:
+            records = transport.receive()
+            if not records:
+                await transport.wait(TRANSPORT_MAX_WAIT)
+                continue
+            await self.handle_records(transport, records)
+            dropped = transport.get_new_drops()
+            if dropped:
+                print(
+                    f"{dropped} trades dropped (ring buffer full) by the feed of "
+                    f"{len(transport.symbols)} symbols"
+                )
+        transport.close()
 
     async def client_server(self, websocket, path: str):
         session_id = str(websocket.id)
         params = self.get_ws_parameters(path)
-        heartbeat_tmstmp = dt.now()
         if not params:
             print(f"Failed connection attempt (invalid parameters): {session_id}")
             await websocket.send("Invalid parameters")
             await websocket.close()
-        else:
-            while True:
-                await self.send_to_aggregator_process(websocket, session_id, params)
+            return
+        client_queue = await self.send_to_aggregator_process(
+            websocket, session_id, params
+        )
+        tasks = [asyncio.create_task(self.receive_from_client(session_id, websocket))]
+        if session_id in self.subscriptions.book_views:
+            tasks.append(asyncio.create_task(self.send_book_views(session_id)))
+        wire_format = params.get("format", "json")
+        try:
+            while session_id in self.clients:
                 try:
-                    await self.send_to_client(websocket, params)
-                    if (dt.now() - heartbeat_tmstmp).seconds > 1:
-                        await websocket.send("heartbeat")
-                        heartbeat_tmstmp = dt.now()
-                except websockets.exceptions.ConnectionClosed:
-                    print(f"Session {session_id} ended")
-                    self.clients.remove(session_id)
-                    await self.empty_queue()
-                    await websocket.close()
-                    return
-                await asyncio.sleep(0)
+                    message = await asyncio.wait_for(client_queue.get(), timeout=1)
+                    await websocket.send(message.encode(wire_format))
+                except asyncio.TimeoutError:
+                    await websocket.send("heartbeat")
+        except websockets.exceptions.ConnectionClosed:
+            print(f"Session {session_id} ended")
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.remove_client(session_id)
 
     def run_clients_websocket(self):
         start_server = websockets.serve(self.client_server, helpers.HOST, WS_PORT)
         asyncio.get_event_loop().run_until_complete(start_server)
-        asyncio.get_event_loop().run_forever()
+        for transport in self.feeds:
+            asyncio.get_event_loop().create_task(self.read_transport(transport))
+        asyncio.get_event_loop().create_task(self.rebalance_feeds())
+        try:
+            asyncio.get_event_loop().run_forever()
+        finally:
+            self.subscription_snapshot.close()
+            for transport in self.feeds:
+                transport.close()
 
 
 if __name__ == "__main__":
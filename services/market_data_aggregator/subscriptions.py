@@ -0,0 +1,205 @@
+import asyncio
+import json
+import struct
+from collections import defaultdict
+from multiprocessing import shared_memory
+
+import msgpack
+
+CLIENT_BUFFER_SIZE = 10_000
+SNAPSHOT_SIZE = 4 * 1024 * 1024
+SNAPSHOT_HEADER = struct.Struct("<QQ")
+
+
+class OutboundMessage:
+    """
+    Update shared by every session it is routed to, encoded at most once per format
+    """
+
+    __slots__ = ("payload", "encoded")
+
+    def __init__(self, method: str, details: dict):
+        self.payload = {method: details}
+        self.encoded = dict()
+
+    def encode(self, wire_format: str) -> str or bytes:
+        if wire_format not in self.encoded:
+            if wire_format == "msgpack":
+                self.encoded[wire_format] = msgpack.packb(self.payload, default=str)
+            else:
+                self.encoded[wire_format] = json.dumps(self.payload, default=str)
+        return self.encoded[wire_format]
+
+
+class SubscriptionRegistry:
+    """
+    Routes each update to the sessions subscribed to its (exchange, channel, symbol)
+    """
+
+    def __init__(self, buffer_size: int = CLIENT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.subscribers = defaultdict(set)
+        self.session_keys = dict()
+        self.session_exchanges = dict()
+        self.session_queues = dict()
+        self.book_views = dict()
+        self.dirty_books = dict()
+        self.dirty_events = dict()
+
+    @staticmethod
+    def get_keys(params: dict) -> set:
+        keys = set()
+        for exchange in params["exchange"]:
+            for method, pairs in params["methods"].items():
+                for pair in pairs:
+                    keys.add((exchange.upper(), method, pair.upper()))
+        return keys
+
+    def subscribe(self, session_id: str, params: dict) -> asyncio.Queue:
+        keys = self.get_keys(params)
+        self.session_keys[session_id] = keys
+        self.session_exchanges[session_id] = params["exchange"]
+        self.session_queues[session_id] = asyncio.Queue(maxsize=self.buffer_size)
+        for key in keys:
+            self.subscribers[key].add(session_id)
+        if params.get("depth") or params.get("conflate_ms"):
+            self.book_views[session_id] = dict(
+                depth=params.get("depth"), conflate_ms=params.get("conflate_ms", 0)
+            )
+            self.dirty_books[session_id] = set()
+            self.dirty_events[session_id] = asyncio.Event()
+        return self.session_queues[session_id]
+
+    def add_keys(self, session_id: str, methods: dict) -> set:
+        """
+        Subscribes a running session to more symbols of its exchanges, returning the
+        keys it was not subscribed to yet
+        """
+        params = dict(exchange=self.session_exchanges[session_id], methods=methods)
+        keys = self.get_keys(params) - self.session_keys[session_id]
+        self.session_keys[session_id] |= keys
+        for key in keys:
+            self.subscribers[key].add(session_id)
+        return keys
+
+    def remove_keys(self, session_id: str, methods: dict):
+        params = dict(exchange=self.session_exchanges[session_id], methods=methods)
+        keys = self.get_keys(params) & self.session_keys[session_id]
+        self.session_keys[session_id] -= keys
+        self.discard_subscriber(session_id, keys)
+
+    def discard_subscriber(self, session_id: str, keys: set):
+        for key in keys:
+            self.subscribers[key].discard(session_id)
+            if not self.subscribers[key]:
+                del self.subscribers[key]
+
+    def unsubscribe(self, session_id: str):
+        self.discard_subscriber(session_id, self.session_keys.pop(session_id, set()))
+        self.session_exchanges.pop(session_id, None)
+        self.session_queues.pop(session_id, None)
+        self.book_views.pop(session_id, None)
+        self.dirty_books.pop(session_id, None)
+        event = self.dirty_events.pop(session_id, None)
+        if event:
+            event.set()
+
+    def send(self, session_id: str, method: str, details: dict) -> bool:
+        return self.send_message(session_id, OutboundMessage(method, details))
+
+    def send_message(self, session_id: str, message: OutboundMessage) -> bool:
+        try:
+            self.session_queues[session_id].put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def mark_dirty(self, session_id: str, key: tuple):
+        self.dirty_books[session_id].add(key)
+        self.dirty_events[session_id].set()
+
+    async def get_dirty_books(self, session_id: str) -> set:
+        event = self.dirty_events[session_id]
+        await event.wait()
+        event.clear()
+        keys = self.dirty_books.get(session_id, set())
+        if session_id in self.dirty_books:
+            self.dirty_books[session_id] = set()
+        return keys
+
+    def publish(self, method: str, details: dict, channel: str = None) -> list:
+        channel = channel or method
+        key = (details["exchange"], channel, details["symbol"])
+        message = OutboundMessage(method, details)
+        slow_sessions = list()
+        for session_id in self.subscribers.get(key, ()):
+            if channel == "book" and session_id in self.book_views:
+                self.mark_dirty(session_id, key)
+            elif not self.send_message(session_id, message):
+                slow_sessions.append(session_id)
+        return slow_sessions
+
+    def keys(self) -> set:
+        return set(self.subscribers.keys())
+
+
+class SubscriptionSnapshot:
+    """
+    Versioned set of subscribed (exchange, channel, symbol) keys held in shared memory.
+    The server publishes a new version on every change, feed processes only decode it
+    when the version moves. An odd version means a write is in progress (seqlock).
+    Each key carries the version it was last subscribed from, so that a feed can tell
+    a key subscribed again from one that never went away.
+    """
+
+    def __init__(self, size: int = SNAPSHOT_SIZE):
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        SNAPSHOT_HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        self.version = 0
+        self.generations = dict()
+        self.cached_version = 0
+        self.cached_keys = frozenset()
+        self.cached_generations = dict()
+
+    def publish(self, keys: set):
+        self.generations = {
+            key: self.generations.get(key, self.version) for key in keys
+        }
+        payload = json.dumps(
+            sorted([*key, generation] for key, generation in self.generations.items())
+        ).encode()
+        if SNAPSHOT_HEADER.size + len(payload) > self.shm.size:
+            raise ValueError(
+                f"Subscription snapshot of {len(payload)} bytes exceeds shared memory"
+            )
+        self.version += 1
+        SNAPSHOT_HEADER.pack_into(self.shm.buf, 0, self.version, 0)
+        self.shm.buf[SNAPSHOT_HEADER.size : SNAPSHOT_HEADER.size + len(payload)] = (
+            payload
+        )
+        self.version += 1
+        SNAPSHOT_HEADER.pack_into(self.shm.buf, 0, self.version, len(payload))
+
+    def get(self) -> frozenset:
+        version, length = SNAPSHOT_HEADER.unpack_from(self.shm.buf, 0)
+        if version == self.cached_version or version % 2:
+            return self.cached_keys
+        payload = bytes(
+            self.shm.buf[SNAPSHOT_HEADER.size : SNAPSHOT_HEADER.size + length]
+        )
+        if SNAPSHOT_HEADER.unpack_from(self.shm.buf, 0)[0] != version:
+            return self.cached_keys
+        self.cached_generations = {
+            tuple(entry[:3]): entry[3] for entry in json.loads(payload)
+        }
+        self.cached_keys = frozenset(self.cached_generations)
+        self.cached_version = version
+        return self.cached_keys
+
+    def get_generation(self, key: tuple) -> int or None:
+        self.get()
+        return self.cached_generations.get(key)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,238 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import struct
+from multiprocessing import shared_memory
+
+from cryptofeed.defines import ASK, BID, BUY
+
+RING_CAPACITY = 2**16
+# levels per side of a book snapshot, at most a quarter of the ring so that a
+# snapshot fits in one write next to the records still unread
+SNAPSHOT_DEPTH = 1000
+POLL_FALLBACK_INTERVAL = 0.001
+INDEX = struct.Struct("<Q")
+WRITE_INDEX_OFFSET = 0
+READ_INDEX_OFFSET = 64
+SLEEPING_OFFSET = 96
+DATA_OFFSET = 128
+
+TRADE_ID_SIZE = 64
+TRADE_TYPE_SIZE = 16
+# kind, side, flags, symbol id, price, amount, timestamp, trade id, trade type
+RECORD = struct.Struct(f"<BBBxIddd{TRADE_ID_SIZE}s{TRADE_TYPE_SIZE}s")
+TRADE = 0
+BOOK = 1
+SNAPSHOT = 1
+END = 2
+SIDES = {TRADE: ("buy", "sell"), BOOK: (BID, ASK)}
+
+
+class RingBuffer:
+    """
+    Single producer / single consumer ring of fixed-size binary records in shared
+    memory. The producer only moves the write index and the consumer only moves the
+    read index, so no lock is needed. An idle consumer raises the sleeping flag and
+    waits on a pipe that the producer only writes to when that flag is set.
+    """
+
+    def __init__(self, capacity: int = RING_CAPACITY):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=DATA_OFFSET + capacity * RECORD.size
+        )
+        INDEX.pack_into(self.shm.buf, WRITE_INDEX_OFFSET, 0)
+        INDEX.pack_into(self.shm.buf, READ_INDEX_OFFSET, 0)
+        self.shm.buf[SLEEPING_OFFSET] = 0
+        self.wake_reader, self.wake_writer = os.pipe()
+        os.set_blocking(self.wake_reader, False)
+        os.set_blocking(self.wake_writer, False)
+
+    def write(self, records: list) -> bool:
+        buf = self.shm.buf
+        write_index = INDEX.unpack_from(buf, WRITE_INDEX_OFFSET)[0]
+        read_index = INDEX.unpack_from(buf, READ_INDEX_OFFSET)[0]
+        if write_index + len(records) - read_index > self.capacity:
+            return False
+        payload = b"".join(RECORD.pack(*record) for record in records)
+        start = write_index % self.capacity
+        head = min(len(records), self.capacity - start) * RECORD.size
+        offset = DATA_OFFSET + start * RECORD.size
+        buf[offset : offset + head] = payload[:head]
+        if head < len(payload):
+            buf[DATA_OFFSET : DATA_OFFSET + len(payload) - head] = payload[head:]
+        INDEX.pack_into(buf, WRITE_INDEX_OFFSET, write_index + len(records))
+        if buf[SLEEPING_OFFSET]:
+            buf[SLEEPING_OFFSET] = 0
+            try:
+                os.write(self.wake_writer, b"\0")
+            except BlockingIOError:
+                pass
+        return True
+
+    def is_empty(self) -> bool:
+        return INDEX.unpack_from(self.shm.buf, WRITE_INDEX_OFFSET) == INDEX.unpack_from(
+            self.shm.buf, READ_INDEX_OFFSET
+        )
+
+    async def wait(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        self.shm.buf[SLEEPING_OFFSET] = 1
+        if not self.is_empty():
+            self.shm.buf[SLEEPING_OFFSET] = 0
+            return
+        woken = loop.create_future()
+        try:
+            loop.add_reader(
+                self.wake_reader, lambda: woken.done() or woken.set_result(None)
+            )
+        except NotImplementedError:
+            # e.g. the Windows proactor loop cannot watch pipes
+            await asyncio.sleep(min(timeout, POLL_FALLBACK_INTERVAL))
+            self.shm.buf[SLEEPING_OFFSET] = 0
+            return
+        try:
+            await asyncio.wait_for(woken, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(self.wake_reader)
+            self.shm.buf[SLEEPING_OFFSET] = 0
+            try:
+                os.read(self.wake_reader, 4096)
+            except BlockingIOError:
+                pass
+
+    def read(self) -> list:
+        buf = self.shm.buf
+        write_index = INDEX.unpack_from(buf, WRITE_INDEX_OFFSET)[0]
+        read_index = INDEX.unpack_from(buf, READ_INDEX_OFFSET)[0]
+        if write_index == read_index:
+            return []
+        start = read_index % self.capacity
+        end = start + write_index - read_index
+        records = list()
+        for segment_start, segment_end in (
+            (start, min(end, self.capacity)),
+            (0, max(end - self.capacity, 0)),
+        ):
+            if segment_end > segment_start:
+                records += RECORD.iter_unpack(
+                    buf[
+                        DATA_OFFSET
+                        + segment_start * RECORD.size : DATA_OFFSET
+                        + segment_end * RECORD.size
+                    ]
+                )
+        INDEX.pack_into(buf, READ_INDEX_OFFSET, write_index)
+        return records
+
+    def close(self):
+        os.close(self.wake_reader)
+        os.close(self.wake_writer)
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FeedTransport:
+    """
+    Ring buffer of one feed process plus the (exchange, symbol) table its records
+    refer to by index.
+    """
+
+    def __init__(self, markets: dict, capacity: int = RING_CAPACITY):
+        self.markets = markets
+        self.symbols = [
+            (exchange, pair) for exchange, pairs in markets.items() for pair in pairs
+        ]
+        self.symbol_ids = {symbol: idx for idx, symbol in enumerate(self.symbols)}
+        self.ring = RingBuffer(capacity)
+        self.snapshot_depth = min(SNAPSHOT_DEPTH, capacity // 4)
+        self.message_counts = multiprocessing.RawArray("Q", len(self.symbols))
+        self.last_counts = [0] * len(self.symbols)
+        self.dropped_trades = multiprocessing.RawValue("Q", 0)
+        self.reported_drops = 0
+        self.is_warming = False
+        self.is_retired = False
+
+    def count(self, data):
+        self.message_counts[self.symbol_ids[(data.exchange, data.symbol)]] += 1
+
+    @staticmethod
+    def encode_text(value, size: int) -> bytes:
+        return b"" if value is None else str(value).encode()[:size]
+
+    @staticmethod
+    def decode_text(value: bytes) -> str or None:
+        return value.rstrip(b"\0").decode(errors="replace") or None
+
+    def send_trade(self, data) -> bool:
+        record = (
+            TRADE,
+            0 if data.side == BUY else 1,
+            END,
+            self.symbol_ids[(data.exchange, data.symbol)],
+            float(data.price),
+            float(data.amount),
+            data.timestamp or 0,
+            self.encode_text(data.id, TRADE_ID_SIZE),
+            self.encode_text(data.type, TRADE_TYPE_SIZE),
+        )
+        if self.ring.write([record]):
+            return True
+        self.dropped_trades.value += 1
+        return False
+
+    def get_new_drops(self) -> int:
+        """
+        Trades dropped on a full ring since the previous call
+        """
+        dropped = self.dropped_trades.value
+        new_drops, self.reported_drops = dropped - self.reported_drops, dropped
+        return new_drops
+
+    def send_book(self, data, snapshot: bool) -> bool:
+        symbol_id = self.symbol_ids[(data.exchange, data.symbol)]
+        if snapshot:
+            levels = [
+                (side, price, size)
+                for side, book_side in ((0, data.book.bids), (1, data.book.asks))
+                for price, size in itertools.islice(
+                    book_side.to_dict().items(), self.snapshot_depth
+                )
+            ]
+        else:
+            levels = [
+                (side, price, size)
+                for side, book_side in ((0, BID), (1, ASK))
+                for price, size in data.delta[book_side]
+            ]
+        if not levels:
+            return True
+        timestamp = data.timestamp or 0
+        last = len(levels) - 1
+        records = [
+            (
+                BOOK,
+                side,
+                (SNAPSHOT if snapshot and not idx else 0) | (END if idx == last else 0),
+                symbol_id,
+                float(price),
+                float(size),
+                timestamp,
+                b"",
+                b"",
+            )
+            for idx, (side, price, size) in enumerate(levels)
+        ]
+        return self.ring.write(records)
+
+    def receive(self) -> list:
+        return self.ring.read()
+
+    async def wait(self, timeout: float):
+        await self.ring.wait(timeout)
+
+    def close(self):
+        self.ring.close()
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import sys
+from datetime import datetime as dt
+
+import pandas as pd
+import sqlalchemy as sql
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from utils import helpers
+
+FILL_BATCH_WINDOW = 0.2
+FILL_RETRY_INTERVAL = 5
+ORDER_COLUMNS = [
+    "order_dim_key",
+    "user_id",
+    "order_id",
+    "broker_id",
+    "trading_env",
+    "trading_type",
+    "asset_id",
+    "order_side",
+    "order_type",
+    "order_creation_tmstmp",
+    "order_status",
+    "fill_pct",
+    "order_volume",
+    "order_price",
+    "insert_tmstmp",
+    "expiration_tmstmp",
+]
+TRADE_COLUMNS = [
+    "trade_dim_key",
+    "user_id",
+    "trade_id",
+    "order_id",
+    "broker_id",
+    "trading_env",
+    "trading_type",
+    "asset_id",
+    "trade_side",
+    "execution_tmstmp",
+    "trade_volume",
+    "trade_price",
+    "insert_tmstmp",
+    "expiration_tmstmp",
+]
+ORDERS_TABLE = sql.table(
+    "crypto_station_api_orders", *[sql.column(column) for column in ORDER_COLUMNS]
+)
+TRADES_TABLE = sql.table(
+    "crypto_station_api_trades", *[sql.column(column) for column in TRADE_COLUMNS]
+)
+EXPIRE_ORDERS = sql.text(
+    "update crypto_station_api_orders set expiration_tmstmp = :expiration_tmstmp "
+    "where order_id = :order_id and expiration_tmstmp is null"
+)
+LOG = helpers.get_logger("fill_writer")
+
+
+def get_rows(df: pd.DataFrame, columns: list) -> list:
+    df = df.reindex(columns=columns).astype(object)
+    return df.where(df.notna(), None).to_dict(orient="records")
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Errors of the connection rather than of the rows, worth retrying as is
+    """
+    return isinstance(error, sql.exc.OperationalError) or getattr(
+        error, "connection_invalidated", False
+    )
+
+
+def write_fills(db: sql.Engine, order_rows: list, trade_rows: list):
+    """
+    In one transaction, expires the current rows of the filled orders, then bulk
+    inserts their new rows and the trades. When an order fills more than once in
+    a batch, only its last new row stays current.
+    """
+    now = dt.now()
+    last_rows = {row["order_id"]: row for row in order_rows}
+    order_rows = [
+        row if last_rows[row["order_id"]] is row else {**row, "expiration_tmstmp": now}
+        for row in order_rows
+    ]
+    with db.begin() as connection:
+        connection.execute(
+            EXPIRE_ORDERS,
+            [dict(order_id=order_id, expiration_tmstmp=now) for order_id in last_rows],
+        )
+        connection.execute(sql.insert(ORDERS_TABLE), order_rows)
+        if trade_rows:
+            connection.execute(sql.insert(TRADES_TABLE), trade_rows)
+
+
+class FillWriter:
+    """
+    Write-behind for live fills: `put` only queues the rows, a background task
+    writes what was queued within `window` seconds as one batch. A batch failing on
+    the connection is kept and retried with the next one. A batch rejected for its
+    rows is written again one order at a time, the orders still rejected being
+    logged and kept aside in `quarantined_rows`.
+    """
+
+    def __init__(self, db: sql.Engine, window: float = FILL_BATCH_WINDOW):
+        self.db = db
+        self.window = window
+        self.order_rows = list()
+        self.trade_rows = list()
+        self.quarantined_rows = list()
+        self.rows_pending = None
+        self.task = None
+
+    def start(self):
+        self.rows_pending = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def put(self, orders_df: pd.DataFrame, trades_df: pd.DataFrame):
+        self.order_rows.extend(get_rows(orders_df, ORDER_COLUMNS))
+        self.trade_rows.extend(get_rows(trades_df, TRADE_COLUMNS))
+        self.rows_pending.set()
+
+    async def flush(self):
+        order_rows, self.order_rows = self.order_rows, list()
+        trade_rows, self.trade_rows = self.trade_rows, list()
+        if not order_rows:
+            return
+        try:
+            await asyncio.to_thread(write_fills, self.db, order_rows, trade_rows)
+        except Exception as e:
+            if is_transient_error(e):
+                self.order_rows[:0] = order_rows
+                self.trade_rows[:0] = trade_rows
+                raise
+            LOG.error(
+                f"Batch of {len(order_rows)} fills rejected, writing them one order "
+                f"at a time: {e}"
+            )
+            await self.flush_each_order(order_rows, trade_rows)
+
+    async def flush_each_order(self, order_rows: list, trade_rows: list):
+        order_ids = list(dict.fromkeys(row["order_id"] for row in order_rows))
+        for idx, order_id in enumerate(order_ids):
+            rows = [row for row in order_rows if row["order_id"] == order_id]
+            trades = [row for row in trade_rows if row["order_id"] == order_id]
+            try:
+                await asyncio.to_thread(write_fills, self.db, rows, trades)
+            except Exception as e:
+                if is_transient_error(e):
+                    remaining = set(order_ids[idx:])
+                    self.order_rows[:0] = [
+                        row for row in order_rows if row["order_id"] in remaining
+                    ]
+                    self.trade_rows[:0] = [
+                        row for row in trade_rows if row["order_id"] in remaining
+                    ]
+                    raise
+                LOG.error(f"Fills of order {order_id} quarantined: {e}")
+                self.quarantined_rows.append((rows, trades))
+
+    async def run(self):
+        while True:
+            await self.rows_pending.wait()
+            await asyncio.sleep(self.window)
+            self.rows_pending.clear()
+            try:
+                await self.flush()
+            except sql.exc.SQLAlchemyError as e:
+                LOG.error(f"{len(self.order_rows)} fills not written, retrying: {e}")
+                self.rows_pending.set()
+                await asyncio.sleep(FILL_RETRY_INTERVAL)
+            except Exception as e:
+                LOG.error(f"Fill writer error: {e!r}")
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
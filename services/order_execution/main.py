@@ -1,27 +1,46 @@
 import asyncio
 import json
+import multiprocessing
 import os
 import platform
 import sys
 import uuid
+import zlib
 from datetime import datetime as dt
 from pathlib import Path
 
 import aiohttp
+import numpy as np
 import pandas as pd
 import redis
 import sqlalchemy as sql
 import websockets
 from dotenv import load_dotenv
+from fill_writer import (
+    ORDER_COLUMNS,
+    TRADE_COLUMNS,
+    FillWriter,
+    get_rows,
+    write_fills,
+)
+from order_book import OpenOrderIndex
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from utils import helpers
+from utils.order_events import NEW_ORDER, RedisOrderEvents
 
 WS_PORT = 8768
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 ENV_PATH = BASE_DIR / ".env"
 load_dotenv(ENV_PATH, verbose=True)
 LOG = helpers.get_logger("order_execution_service")
+PARTITION_AMOUNT = int(os.getenv("ORDER_EXECUTION_PARTITIONS", 1))
+TRADE_FEED_RETRY_INTERVAL = 1
+TRADE_FEED_MAX_RETRY_INTERVAL = 30
+
+
+def get_partition(user_id: str, partition_amount: int) -> int:
+    return zlib.crc32(user_id.encode()) % partition_amount
 
 
 class OnStartChecker:
@@ -41,12 +60,14 @@ class OnStartChecker:
     async def get_all_ohlcv(self):
         if self.verbose:
             LOG.info("Retrieving OHLCV data")
+        urls = {
+            self.get_url(order): order["asset_id"]
+            for order in self.open_orders_df.to_dict(orient="index").values()
+        }
         async with aiohttp.ClientSession() as session:
             tasks = [
-                asyncio.ensure_future(
-                    helpers.async_get(session, self.get_url(order), order["asset_id"])
-                )
-                for order in self.open_orders_df.to_dict(orient="index").values()
+                asyncio.ensure_future(helpers.async_get(session, url, pair))
+                for url, pair in urls.items()
             ]
             responses = await asyncio.gather(*tasks)
             for response in responses:
@@ -57,33 +78,40 @@ class OnStartChecker:
                 )
                 self.data[pair] = df
 
-    def get_execution_tmstmp(self, order: pd.Series) -> dt:
-        pair = order["asset_id"]
-        ohlcv_df = self.data[pair]
-        execution_df = ohlcv_df[
-            ohlcv_df["time"] >= dt.timestamp(order["order_creation_tmstmp"]) * 1000
-        ]
-        if order["order_side"] == "buy":
-            execution_df = execution_df[
-                execution_df.apply(lambda x: min(x["close"], x["low"]), axis=1)
-                < order["order_price"]
-            ]
-        else:
-            execution_df = execution_df[
-                execution_df.apply(lambda x: max(x["close"], x["high"]), axis=1)
-                > order["order_price"]
-            ]
+    @staticmethod
+    def get_first_crossings(
+        candle_times: np.ndarray,
+        lows: np.ndarray,
+        highs: np.ndarray,
+        start_times: np.ndarray,
+        prices: np.ndarray,
+        is_buy: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Index of the first candle, from each order's start time on, trading through
+        the order's price, -1 if none. Orders starting on the same candle share one
+        running min / max of the candles, searched for all their prices at once.
+        """
+        starts = np.searchsorted(candle_times, start_times, side="left")
+        crossings = np.full(len(prices), -1)
+        for start in np.unique(starts[starts < len(candle_times)]):
+            buys = (starts == start) & is_buy
+            lowest = np.minimum.accumulate(lows[start:])
+            idx = np.searchsorted(-lowest, -prices[buys], side="right")
+            crossings[buys] = np.where(idx < len(lowest), start + idx, -1)
+            sells = (starts == start) & ~is_buy
+            highest = np.maximum.accumulate(highs[start:])
+            idx = np.searchsorted(highest, prices[sells], side="right")
+            crossings[sells] = np.where(idx < len(highest), start + idx, -1)
+        return crossings
+
+    def log_order_check(self, order: dict, execution_tmstmp: dt, last_close: float):
         base_log = f"{order['broker_id']} {order['asset_id']} {order['trading_type']} {order['order_side']}"
-        if not execution_df.empty:
-            if self.verbose:
-                LOG.info(
-                    f"{base_log} EXECUTED: {order['order_volume']} @ {order['order_price']}"
-                )
-            return dt.fromtimestamp(execution_df["time"].min() / 1000)
-        elif ohlcv_df.empty:
-            LOG.error(f"No OHLCV data for {pair}")
-        elif self.verbose:
-            last_close = ohlcv_df.iloc[-1]["close"]
+        if execution_tmstmp:
+            LOG.info(
+                f"{base_log} EXECUTED: {order['order_volume']} @ {order['order_price']}"
+            )
+        else:
             distance_to_exec = (
                 last_close / order["order_price"]
                 if order["order_side"] == "buy"
@@ -93,65 +121,50 @@ class OnStartChecker:
                 f"{base_log} not executed: {distance_to_exec:.2%} away from target price"
             )
 
-    def check_order(self, order_id: str):
-        order = self.open_orders_df[
-            self.open_orders_df["order_id"] == order_id
-        ].squeeze()
-        execution_tmstmp = self.get_execution_tmstmp(order)
-        if execution_tmstmp:
-            self.filled_orders[order_id] = execution_tmstmp
+    def check_pair_orders(self, pair: str, orders: pd.DataFrame):
+        ohlcv_df = self.data[pair]
+        if ohlcv_df.empty:
+            LOG.error(f"No OHLCV data for {pair}")
+            return
+        candle_times = ohlcv_df["time"].to_numpy(dtype=float)
+        close = ohlcv_df["close"].to_numpy(dtype=float)
+        crossings = self.get_first_crossings(
+            candle_times,
+            np.minimum(close, ohlcv_df["low"].to_numpy(dtype=float)),
+            np.maximum(close, ohlcv_df["high"].to_numpy(dtype=float)),
+            orders["order_creation_tmstmp"].map(dt.timestamp).to_numpy() * 1000,
+            orders["order_price"].to_numpy(dtype=float),
+            (orders["order_side"] == "buy").to_numpy(),
+        )
+        for order, crossing in zip(orders.to_dict(orient="records"), crossings):
+            execution_tmstmp = (
+                dt.fromtimestamp(candle_times[crossing] / 1000)
+                if crossing >= 0
+                else None
+            )
+            if execution_tmstmp:
+                self.filled_orders[order["order_id"]] = execution_tmstmp
+            if self.verbose:
+                self.log_order_check(order, execution_tmstmp, close[-1])
 
     async def check_all_open_orders(self):
-        orders = self.open_orders_df["order_id"].unique().tolist()
+        orders = self.open_orders_df.drop_duplicates(subset="order_id")
         if self.verbose:
             LOG.info(f"Will check {len(orders)} open orders")
         await self.get_all_ohlcv()
-        for order_id in orders:
-            self.check_order(order_id)
-
-    def cancel_previous_records(self, orders_df: pd.DataFrame = None):
-        order_id_list = (
-            list(self.filled_orders.keys())
-            if orders_df is None
-            else orders_df["order_id"].tolist()
-        )
-        order_id_list = "','".join(order_id_list)
-        query = (
-            f"update crypto_station_api_orders set expiration_tmstmp = '{dt.now()}' "
-            f"where order_id in ('{order_id_list}') and expiration_tmstmp is null"
-        )
-        with self.db.connect() as connection:
-            connection.execute(sql.text(query))
-            connection.commit()
+        for pair, pair_orders in orders.groupby("asset_id"):
+            self.check_pair_orders(pair, pair_orders)
 
     def get_updated_order_rows_df(self) -> pd.DataFrame:
-        df = pd.DataFrame()
-        for order_id in self.filled_orders:
-            order_df = self.open_orders_df[self.open_orders_df["order_id"] == order_id]
-            df = pd.concat([df, order_df])
+        df = self.open_orders_df[
+            self.open_orders_df["order_id"].isin(self.filled_orders)
+        ].copy()
         df.loc[:, "insert_tmstmp"] = dt.now()
         df.loc[:, "fill_pct"] = 1
         df.loc[:, "order_status"] = "executed"
-        df["order_dim_key"] = df.apply(lambda x: str(uuid.uuid4()), axis=1)
+        df["order_dim_key"] = [str(uuid.uuid4()) for _ in range(len(df))]
         return df
 
-    def add_updated_order_rows(self, orders_df: pd.DataFrame = None):
-        if orders_df is None:
-            orders_df = self.get_updated_order_rows_df()
-        orders_df["order_dim_key"] = orders_df.apply(
-            lambda x: str(uuid.uuid4()), axis=1
-        )
-        orders_df.to_sql(
-            "crypto_station_api_orders",
-            con=self.db,
-            if_exists="append",
-            index=False,
-        )
-
-    def update_orders(self, orders_df: pd.DataFrame = None):
-        self.cancel_previous_records(orders_df)
-        self.add_updated_order_rows(orders_df)
-
     def get_trades_df(self, updates_orders_df: pd.DataFrame = None) -> pd.DataFrame:
         if updates_orders_df is None:
             updates_orders_df = self.get_updated_order_rows_df()
@@ -171,25 +184,18 @@ class OnStartChecker:
             trades_df = trades_df.rename(columns={f"order_{column}": f"trade_{column}"})
         trades_df.loc[:, "insert_tmstmp"] = dt.now()
         trades_df["execution_tmstmp"] = (
-            trades_df["order_id"].apply(lambda x: self.filled_orders[x])
-            if updates_orders_df is not None
-            else dt.now()
+            trades_df["order_id"].map(self.filled_orders).fillna(dt.now())
         )
         return trades_df
 
-    def add_trades(self, trades_df: pd.DataFrame = None):
-        if trades_df is None:
-            trades_df = self.get_trades_df()
-        trades_df.to_sql(
-            "crypto_station_api_trades",
-            con=self.db,
-            if_exists="append",
-            index=False,
-        )
-
     def update_db(self):
-        self.update_orders()
-        self.add_trades()
+        orders_df = self.get_updated_order_rows_df()
+        trades_df = self.get_trades_df(orders_df)
+        write_fills(
+            self.db,
+            get_rows(orders_df, ORDER_COLUMNS),
+            get_rows(trades_df, TRADE_COLUMNS),
+        )
 
     async def run_on_start_checker(self):
         await self.check_all_open_orders()
@@ -198,8 +204,27 @@ class OnStartChecker:
 
 
 class OrderExecutionService(OnStartChecker):
-    def __init__(self, verbose: bool = True):
+    """
+    Matches the trades of the aggregator against the open orders of all users,
+    or with `partition_amount` > 1, of the users hashed to `partition`. Orders
+    created or cancelled afterwards come from `order_events`, and the trade
+    subscriptions follow the symbols of the open orders.
+    """
+
+    def __init__(
+        self,
+        verbose: bool = True,
+        partition: int = 0,
+        partition_amount: int = 1,
+        order_events=None,
+    ):
         self.verbose = verbose
+        self.partition = partition
+        self.partition_amount = partition_amount
+        self.order_events = order_events or RedisOrderEvents()
+        self.trade_listeners = dict()
+        self.pending_order_events = list()
+        self.is_index_loaded = False
         self.users = None
         redis_host = "localhost"
         redis_port = 6379
@@ -207,13 +232,22 @@ class OrderExecutionService(OnStartChecker):
             host=redis_host, port=redis_port, decode_responses=True
         )
         self.db = helpers.get_db_connection()
-        self.orders = self.retrieve_from_db()
+        self.fill_writer = FillWriter(self.db)
+        self.order_index = OpenOrderIndex()
+        self.orders = None
         if "linux" not in platform.platform():
             super().__init__(open_orders_df=self.orders, db=self.db, verbose=verbose)
 
     async def initialize_service(self):
+        """
+        Loads the open orders snapshot, to be called once subscribed to the order
+        events so that no change made meanwhile is missed
+        """
+        self.orders = self.retrieve_from_db()
+        self.open_orders_df = self.orders
         await self.run_on_start_checker()
         self.add_user_channels()
+        self.load_order_index()
 
     def retrieve_from_db(self) -> pd.DataFrame:
         if self.verbose:
@@ -222,7 +256,19 @@ class OrderExecutionService(OnStartChecker):
             "select * from crypto_station.public.crypto_station_api_orders "
             "where order_status = 'open' and expiration_tmstmp is null"
         )
-        return pd.read_sql_query(sql=query, con=self.db)
+        orders = pd.read_sql_query(sql=query, con=self.db)
+        if self.partition_amount > 1:
+            partitions = orders["user_id"].map(
+                lambda user: get_partition(user, self.partition_amount)
+            )
+            orders = orders[partitions == self.partition]
+        return orders
+
+    def is_own_user(self, user_id: str) -> bool:
+        return (
+            self.partition_amount <= 1
+            or get_partition(user_id, self.partition_amount) == self.partition
+        )
 
     def add_user_channels(self):
         self.users = self.orders["user_id"].unique().tolist()
@@ -236,25 +282,60 @@ class OrderExecutionService(OnStartChecker):
         redis_data = self.redis_client.get(user_id)
         return pd.DataFrame(json.loads(redis_data))
 
+    def load_order_index(self):
+        for user in self.users:
+            redis_data = self.retrieve_from_redis(user)
+            for order in redis_data.to_dict(orient="records"):
+                # already filled by the on-start check
+                if order["order_id"] not in self.filled_orders:
+                    self.order_index.add(order)
+
     def get_asset_list(self, broker: str) -> list:
-        redis_data = self.retrieve_from_redis("thomasbouamoud")
-        broker_df = redis_data[redis_data["broker_id"] == broker]
         return [
             asset.lower().replace("/", "-")
-            for asset in broker_df["asset_id"].unique().tolist()
+            for asset in self.order_index.get_symbols(broker)
         ]
 
-    @staticmethod
-    def get_filled_qty(order: pd.Series, trade_data: dict) -> float:
-        if (
-            order["order_side"] == "buy" and trade_data["price"] < order["order_price"]
-        ) or (
-            order["order_side"] == "sell" and trade_data["price"] > order["order_price"]
-        ):
-            return order["order_volume"]
-        if trade_data["price"] == order["order_price"]:
-            return min(trade_data["amount"], order["order_volume"])
-        return 0
+    def get_subscriptions(self) -> dict:
+        return {
+            broker: self.get_asset_list(broker)
+            for broker in self.order_index.get_brokers()
+        }
+
+    def update_order_index(self, crossed_orders: list):
+        for order, filled_qty in crossed_orders:
+            if filled_qty >= order["order_volume"]:
+                self.order_index.remove(order["order_id"])
+            else:
+                order["order_volume"] -= filled_qty
+
+    def apply_order_event(self, event: dict):
+        order = event["order"]
+        if not self.is_own_user(order["user_id"]):
+            return
+        if event["type"] == NEW_ORDER and order["order_status"] == "open":
+            self.order_index.add(order)
+            if order["user_id"] not in self.users:
+                self.users.append(order["user_id"])
+        else:
+            self.order_index.remove(order["order_id"])
+        self.refresh_subscriptions()
+
+    async def consume_order_events(self, subscribed: asyncio.Event):
+        """
+        Events received before the order index is loaded are kept for replay
+        """
+        async for event in self.order_events.listen(subscribed):
+            if self.is_index_loaded:
+                self.apply_order_event(event)
+            else:
+                self.pending_order_events.append(event)
+
+    def replay_order_events(self):
+        events, self.pending_order_events = self.pending_order_events, list()
+        for event in events:
+            self.apply_order_event(event)
+        self.is_index_loaded = True
 
     async def handle_fills(self, filled_orders: pd.DataFrame):
         if not filled_orders.empty:
@@ -271,43 +352,166 @@ class OrderExecutionService(OnStartChecker):
             )
             filled_orders["order_volume"] = filled_orders["filled_qty"]
             filled_orders.drop(columns="filled_qty", inplace=True)
+            filled_orders["order_dim_key"] = [
+                str(uuid.uuid4()) for _ in range(len(filled_orders))
+            ]
             trades_df = self.get_trades_df(filled_orders)
-            self.update_orders(filled_orders)
-            self.add_trades(trades_df)
+            self.fill_writer.put(filled_orders, trades_df)
 
-    async def check_fills(self, raw_trade_data: str):
-        trade_data = json.loads(raw_trade_data)
+    async def check_fills(self, raw_trade_data: str or bytes):
+        trade_data = helpers.decode_ws_message(raw_trade_data)
         trade_data = trade_data["trades"]
-        orders = self.retrieve_from_redis("thomasbouamoud")
-        trade_pair = trade_data["symbol"]
-        trade_pair = trade_pair.replace("-", "/")
-        orders = orders[orders["asset_id"] == trade_pair]
-        orders["filled_qty"] = orders.apply(
-            lambda x: self.get_filled_qty(x, trade_data), axis=1
+        crossed_orders = self.order_index.get_crossed_orders(
+            trade_data["exchange"],
+            trade_data["symbol"],
+            trade_data["price"],
+            trade_data["amount"],
+        )
+        if not crossed_orders:
+            return
+        filled_orders = pd.DataFrame(
+            [dict(order, filled_qty=filled_qty) for order, filled_qty in crossed_orders]
         )
-        orders["filled_qty"] = orders["order_volume"]
-        filled_orders = orders[orders["filled_qty"] > 0]
+        self.update_order_index(crossed_orders)
         await self.handle_fills(filled_orders)
+        self.refresh_subscriptions()
+
+    async def listen_trades(self, broker: str, symbols_changed: asyncio.Event):
+        retry_interval = TRADE_FEED_RETRY_INTERVAL
+        while True:
+            assets = self.get_asset_list(broker)
+            uri = f"{helpers.BASE_WS}{WS_PORT}?exchange={broker}?trades={','.join(assets)}?format=msgpack"
+            try:
+                async with websockets.connect(uri, ping_interval=None) as websocket:
+                    retry_interval = TRADE_FEED_RETRY_INTERVAL
+                    sync_task = asyncio.create_task(
+                        self.sync_trade_symbols(
+                            broker, websocket, set(assets), symbols_changed
+                        )
+                    )
+                    try:
+                        while True:
+                            response = await websocket.recv()
+                            if response != "heartbeat":
+                                await self.check_fills(response)
+                    finally:
+                        sync_task.cancel()
+            except (
+                OSError,
+                websockets.ConnectionClosed,
+                asyncio.IncompleteReadError,
+            ):
+                LOG.error(
+                    f"The Real Time Data service is down, reconnecting {broker} in "
+                    f"{retry_interval}s"
+                )
+            await asyncio.sleep(retry_interval)
+            retry_interval = min(2 * retry_interval, TRADE_FEED_MAX_RETRY_INTERVAL)
+
+    async def sync_trade_symbols(
+        self,
+        broker: str,
+        websocket,
+        listened_assets: set,
+        symbols_changed: asyncio.Event,
+    ):
+        """
+        Subscribes the live trade feed of `broker` to the symbols of its new open
+        orders and unsubscribes it from those left without any, on the same
+        connection so the other symbols keep receiving trades
+        """
+        while True:
+            await symbols_changed.wait()
+            symbols_changed.clear()
+            assets = set(self.get_asset_list(broker))
+            request = dict()
+            if assets - listened_assets:
+                request["subscribe"] = dict(trades=sorted(assets - listened_assets))
+            if listened_assets - assets:
+                request["unsubscribe"] = dict(trades=sorted(listened_assets - assets))
+            if request:
+                try:
+                    await websocket.send(json.dumps(request))
+                except websockets.ConnectionClosed:
+                    return
+                listened_assets = assets
+
+    def handle_listener_done(self, task: asyncio.Task):
+        if task.cancelled():
+            return
+        LOG.error(f"Trade listener stopped: {task.exception()!r}")
+        asyncio.get_running_loop().call_later(
+            TRADE_FEED_MAX_RETRY_INTERVAL, self.refresh_subscriptions
+        )
+
+    def refresh_subscriptions(self):
+        """
+        Starts a trade feed for each broker with open orders, stops those left
+        without any and restarts stopped feeds. A running feed follows the symbols
+        of its broker's orders on its live connection.
+        """
+        brokers = self.order_index.get_brokers()
+        for broker in set(self.trade_listeners) | set(brokers):
+            symbols_changed, task = self.trade_listeners.get(broker, (None, None))
+            if broker in brokers and task is not None and not task.done():
+                symbols_changed.set()
+                continue
+            if task is not None:
+                task.cancel()
+                del self.trade_listeners[broker]
+            if broker in brokers:
+                symbols_changed = asyncio.Event()
+                task = asyncio.create_task(self.listen_trades(broker, symbols_changed))
+                task.add_done_callback(self.handle_listener_done)
+                self.trade_listeners[broker] = (symbols_changed, task)
+            if self.verbose:
+                LOG.info(
+                    f"Listening to {len(self.get_asset_list(broker))} {broker} symbols"
+                )
 
     async def initialize_websocket(self):
+        subscribed = asyncio.Event()
+        order_events = asyncio.create_task(self.consume_order_events(subscribed))
+        await asyncio.wait(
+            [order_events, asyncio.create_task(subscribed.wait())],
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if order_events.done():
+            order_events.result()
         await self.initialize_service()
-        broker = "coinbase"
-        assets = self.get_asset_list(broker)
-        uri = f"{helpers.BASE_WS}{WS_PORT}?exchange={broker}?trades={','.join(assets)}"
+        self.replay_order_events()
+        if self.verbose:
+            LOG.info(
+                f"Matching {len(self.order_index)} open orders of {len(self.users)} "
+                "users"
+            )
+        self.refresh_subscriptions()
+        self.fill_writer.start()
         try:
-            async with websockets.connect(uri, ping_interval=None) as websocket:
-                while True:
-                    response = await websocket.recv()
-                    if response != "heartbeat":
-                        await self.check_fills(response)
-        except (
-            ConnectionRefusedError
-            or websockets.ConnectionClosedError
-            or asyncio.IncompleteReadError
-        ):
-            LOG.error("The Real Time Data service is down.")
+            await order_events
+        finally:
+            await self.fill_writer.close()
+
+
+def run_partition(partition: int, partition_amount: int):
+    oes = OrderExecutionService(partition=partition, partition_amount=partition_amount)
+    asyncio.run(oes.initialize_websocket())
+
+
+def run_partitions(partition_amount: int = PARTITION_AMOUNT):
+    if partition_amount <= 1:
+        return run_partition(0, 1)
+    processes = [
+        multiprocessing.Process(
+            target=run_partition, args=(partition, partition_amount)
+        )
+        for partition in range(partition_amount)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
 
 
 if __name__ == "__main__":
-    oes = OrderExecutionService()
-    asyncio.get_event_loop().run_until_complete(oes.initialize_websocket())
+    run_partitions()
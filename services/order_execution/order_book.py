@@ -0,0 +1,105 @@
+import bisect
+import itertools
+import math
+
+
+class OpenOrderIndex:
+    """
+    Resting orders by (broker, symbol), each side kept sorted so that a trade only
+    visits the orders its price crosses: O(log n + k). Buy orders are keyed by
+    their negated price, so both sides start with their most aggressive order, and
+    ties keep their arrival order.
+    """
+
+    def __init__(self):
+        self.books = dict()
+        self.locations = dict()
+        self.sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    @staticmethod
+    def get_book_key(broker: str, symbol: str) -> tuple:
+        return broker.lower(), symbol.replace("-", "/").upper()
+
+    def get_side(self, broker: str, symbol: str, side: str) -> tuple:
+        book = self.books.setdefault(
+            self.get_book_key(broker, symbol),
+            dict(buy=(list(), list()), sell=(list(), list())),
+        )
+        return book[side]
+
+    def add(self, order: dict):
+        if order["order_id"] in self.locations:
+            self.remove(order["order_id"])
+        side = order["order_side"]
+        price = float(order["order_price"])
+        key = (-price if side == "buy" else price, next(self.sequence))
+        keys, orders = self.get_side(order["broker_id"], order["asset_id"], side)
+        idx = bisect.bisect(keys, key)
+        keys.insert(idx, key)
+        orders.insert(idx, order)
+        self.locations[order["order_id"]] = (
+            order["broker_id"],
+            order["asset_id"],
+            side,
+            key,
+        )
+
+    def remove(self, order_id: str) -> dict or None:
+        location = self.locations.pop(order_id, None)
+        if location is None:
+            return None
+        broker, symbol, side, key = location
+        keys, orders = self.get_side(broker, symbol, side)
+        idx = bisect.bisect_left(keys, key)
+        del keys[idx]
+        return orders.pop(idx)
+
+    def get(self, order_id: str) -> dict or None:
+        location = self.locations.get(order_id)
+        if location is None:
+            return None
+        broker, symbol, side, key = location
+        keys, orders = self.get_side(broker, symbol, side)
+        return orders[bisect.bisect_left(keys, key)]
+
+    def get_crossed_orders(
+        self, broker: str, symbol: str, price: float, amount: float
+    ) -> list:
+        """
+        (order, filled quantity) for every order the trade crosses. Orders priced
+        through the trade fill completely, orders at the trade price fill up to the
+        traded amount.
+        """
+        book = self.books.get(self.get_book_key(broker, symbol))
+        if book is None:
+            return []
+        crossed = list()
+        for side, limit in (("buy", -price), ("sell", price)):
+            keys, orders = book[side]
+            for order in orders[: bisect.bisect_right(keys, (limit, math.inf))]:
+                volume = float(order["order_volume"])
+                if float(order["order_price"]) == price:
+                    crossed.append((order, min(amount, volume)))
+                else:
+                    crossed.append((order, volume))
+        return crossed
+
+    def get_brokers(self) -> list:
+        return sorted(
+            {
+                broker
+                for (broker, _), book in self.books.items()
+                if book["buy"][0] or book["sell"][0]
+            }
+        )
+
+    def get_symbols(self, broker: str) -> list:
+        broker = broker.lower()
+        return [
+            symbol
+            for (book_broker, symbol), book in self.books.items()
+            if book_broker == broker and (book["buy"][0] or book["sell"][0])
+        ]
@@ -0,0 +1,166 @@
+import math
+from collections import deque
+
+NAN = float("nan")
+
+
+class AdjustedEwm:
+    """
+    pandas `ewm(alpha=alpha, min_periods=min_periods).mean()` (adjust=True) kept as a
+    running numerator / denominator
+    """
+
+    def __init__(self, alpha: float, min_periods: int):
+        self.decay = 1 - alpha
+        self.min_periods = min_periods
+        self.numerator = 0.0
+        self.denominator = 0.0
+        self.count = 0
+
+    def peek(self, value: float) -> float:
+        if self.count + 1 < self.min_periods:
+            return NAN
+        numerator = value + self.decay * self.numerator
+        return numerator / (1 + self.decay * self.denominator)
+
+    def push(self, value: float):
+        self.numerator = value + self.decay * self.numerator
+        self.denominator = 1 + self.decay * self.denominator
+        self.count += 1
+
+
+class SeededEma:
+    """
+    pandas_ta `ema`: SMA of the first `length` values, then `ewm(span=length,
+    adjust=False)`
+    """
+
+    def __init__(self, length: int):
+        self.length = length
+        self.alpha = 2 / (length + 1)
+        self.count = 0
+        self.total = 0.0
+        self.value = None
+
+    def peek(self, value: float) -> float:
+        if self.value is not None:
+            return self.alpha * value + (1 - self.alpha) * self.value
+        if self.count + 1 == self.length:
+            return (self.total + value) / self.length
+        return NAN
+
+    def push(self, value: float):
+        if self.value is not None:
+            self.value = self.peek(value)
+            return
+        self.count += 1
+        self.total += value
+        if self.count == self.length:
+            self.value = self.total / self.length
+
+
+class RollingWindow:
+    """
+    Sum and sum of squares of the last `length - 1` committed values, so a window
+    ending on the live value costs O(1)
+    """
+
+    def __init__(self, length: int):
+        self.length = length
+        self.values = deque(maxlen=length - 1)
+        self.total = 0.0
+        self.squares = 0.0
+
+    def peek(self, value: float, ddof: int) -> tuple:
+        if len(self.values) + 1 < self.length:
+            return NAN, NAN
+        mean = (self.total + value) / self.length
+        variance = (self.squares + value**2 - self.length * mean**2) / (
+            self.length - ddof
+        )
+        return mean, math.sqrt(max(variance, 0))
+
+    def push(self, value: float):
+        self.values.append(value)
+        # re-summing the short window once per candle avoids float drift
+        self.total = sum(self.values)
+        self.squares = sum(value**2 for value in self.values)
+
+
+class IncrementalIndicators:
+    """
+    Same columns and values as the pandas_ta strategy used by the screener (BBANDS,
+    RSI, MACD), computed from rolling state over the committed candles. The live
+    candle is evaluated in O(1) with `update` and only enters the state once it is
+    closed with `commit`.
+    """
+
+    def __init__(
+        self,
+        bb_length: int = 20,
+        bb_std: float = 2.0,
+        bb_ddof: int = 0,
+        rsi_length: int = 14,
+        macd_fast: int = 8,
+        macd_slow: int = 21,
+        macd_signal: int = 9,
+    ):
+        self.bb_std = bb_std
+        self.bb_ddof = bb_ddof
+        self.bb_window = RollingWindow(bb_length)
+        self.rsi_gains = AdjustedEwm(1 / rsi_length, rsi_length)
+        self.rsi_losses = AdjustedEwm(1 / rsi_length, rsi_length)
+        self.macd_fast = SeededEma(macd_fast)
+        self.macd_slow = SeededEma(macd_slow)
+        self.macd_signal = SeededEma(macd_signal)
+        self.last_close = None
+        self.bb_suffix = f"{bb_length}_{bb_std}"
+        self.rsi_suffix = f"{rsi_length}"
+        self.macd_suffix = f"{macd_fast}_{macd_slow}_{macd_signal}"
+
+    def seed(self, closes: list) -> dict:
+        for close in closes[:-1]:
+            self.commit(close)
+        return self.update(closes[-1]) if closes else dict()
+
+    def commit(self, close: float):
+        if self.last_close is not None:
+            change = close - self.last_close
+            self.rsi_gains.push(max(change, 0))
+            self.rsi_losses.push(min(change, 0))
+        self.last_close = close
+        self.bb_window.push(close)
+        macd = self.macd_fast.peek(close) - self.macd_slow.peek(close)
+        self.macd_fast.push(close)
+        self.macd_slow.push(close)
+        if not math.isnan(macd):
+            self.macd_signal.push(macd)
+
+    def get_rsi(self, close: float) -> float:
+        if self.last_close is None:
+            return NAN
+        change = close - self.last_close
+        gains = self.rsi_gains.peek(max(change, 0))
+        losses = abs(self.rsi_losses.peek(min(change, 0)))
+        if gains + losses == 0:
+            return NAN
+        return 100 * gains / (gains + losses)
+
+    def update(self, close: float) -> dict:
+        mid, std = self.bb_window.peek(close, self.bb_ddof)
+        lower = mid - self.bb_std * std
+        upper = mid + self.bb_std * std
+        width = upper - lower
+        macd = self.macd_fast.peek(close) - self.macd_slow.peek(close)
+        signal = self.macd_signal.peek(macd) if not math.isnan(macd) else NAN
+        return {
+            f"BBL_{self.bb_suffix}": lower,
+            f"BBM_{self.bb_suffix}": mid,
+            f"BBU_{self.bb_suffix}": upper,
+            f"BBB_{self.bb_suffix}": 100 * width / mid if mid else NAN,
+            f"BBP_{self.bb_suffix}": (close - lower) / width if width else NAN,
+            f"RSI_{self.rsi_suffix}": self.get_rsi(close),
+            f"MACD_{self.macd_suffix}": macd,
+            f"MACDh_{self.macd_suffix}": macd - signal,
+            f"MACDs_{self.macd_suffix}": signal,
+        }
@@ -4,41 +4,45 @@ import pandas as pd
 
 class FractalCandlestickPattern:
     def __init__(self, df: pd.DataFrame):
-        self.df = df.reset_index(drop=True)
+        self.low = np.asarray(df["low"], dtype=np.float64)
+        self.high = np.asarray(df["high"], dtype=np.float64)
         self.levels = []
         self.output = []
 
-    def is_support(self, i):
-        cond1 = self.df["low"][i] < self.df["low"][i - 1]
-        cond2 = self.df["low"][i] < self.df["low"][i + 1]
-        cond3 = self.df["low"][i + 1] < self.df["low"][i + 2]
-        cond4 = self.df["low"][i - 1] < self.df["low"][i - 2]
-        return cond1 and cond2 and cond3 and cond4
+    @staticmethod
+    def get_fractal_mask(values: np.ndarray) -> np.ndarray:
+        """
+        Candles 2 to n - 3 that are lower than both neighbours, with the two
+        neighbours themselves lower than the candles next to them
+        """
+        center = values[2:-2]
+        return (
+            (center < values[1:-3])
+            & (center < values[3:-1])
+            & (values[3:-1] < values[4:])
+            & (values[1:-3] < values[:-4])
+        )
 
-    def is_resistance(self, i):
-        cond1 = self.df["high"][i] > self.df["high"][i - 1]
-        cond2 = self.df["high"][i] > self.df["high"][i + 1]
-        cond3 = self.df["high"][i + 1] > self.df["high"][i + 2]
-        cond4 = self.df["high"][i - 1] > self.df["high"][i - 2]
-        return cond1 and cond2 and cond3 and cond4
-
-    # to make sure the new level area does not exist already
-    def is_far_from_level(self, value, levels):
-        ave = np.mean(self.df["high"] - self.df["low"])
-        nearest_levels = [level for _, level in levels if abs(value - level) < ave]
-        return len(nearest_levels) == 0
-
-    def handle_level(self, i: int):
-        level = self.df["high"][i]
-        is_far_from_level = self.is_far_from_level(level, self.levels)
-        if is_far_from_level:
-            self.levels.append((i, level))
-            self.output.append(level)
+    def get_candidates(self) -> np.ndarray:
+        if len(self.low) < 5:
+            return np.empty(0, dtype=np.int64)
+        is_support = self.get_fractal_mask(self.low)
+        is_resistance = self.get_fractal_mask(-self.high)
+        return np.flatnonzero(is_support | is_resistance) + 2
 
     def run(self):
-        for i in range(2, len(self.df) - 2):
-            if self.is_support(i) or self.is_resistance(i):
-                self.handle_level(i)
+        candidates = self.get_candidates()
+        if not len(candidates):
+            return self.output
+        ave = np.mean(self.high - self.low)
+        accepted = np.empty(len(candidates), dtype=np.float64)
+        for i in candidates:
+            level = self.high[i]
+            # to make sure the new level area does not exist already
+            if not (np.abs(level - accepted[: len(self.output)]) < ave).any():
+                accepted[len(self.output)] = level
+                self.levels.append((i, level))
+                self.output.append(level)
         return self.output
 
 
@@ -46,24 +50,33 @@ def get_vbp(ohlcv: pd.DataFrame, periods: int = 30) -> pd.DataFrame:
     """
     Volume by price
     """
-    last_close = ohlcv["close"].iloc[-1]
-    ohlcv["volume_type"] = ohlcv.apply(
-        lambda row: "positive" if row["close"] > row["open"] else "negative", axis=1
+    close = np.asarray(ohlcv["close"], dtype=np.float64)
+    volume = np.asarray(ohlcv["volume"], dtype=np.float64)
+    is_positive = close > np.asarray(ohlcv["open"], dtype=np.float64)
+    price_bins = pd.qcut(close, q=periods, duplicates="drop")
+    bin_amount = len(price_bins.categories)
+    is_binned = price_bins.codes >= 0
+    codes = price_bins.codes[is_binned]
+    positive = np.bincount(
+        codes,
+        weights=np.where(is_positive, volume, 0)[is_binned],
+        minlength=bin_amount,
     )
-    ohlcv["price_bin"] = pd.qcut(ohlcv["close"], q=periods, duplicates="drop")
-    volume_by_type = (
-        ohlcv.groupby(["price_bin", "volume_type"])["volume"]
-        .sum()
-        .unstack()
-        .fillna(0)
-        .reset_index()
+    negative = np.bincount(
+        codes,
+        weights=np.where(is_positive, 0, volume)[is_binned],
+        minlength=bin_amount,
     )
-    total_volume = ohlcv.groupby("price_bin")["volume"].sum().reset_index()
-    vbp = pd.merge(total_volume, volume_by_type, on="price_bin")
-    vbp["close"] = vbp["price_bin"].apply(lambda x: min(x.left, x.right))
-    vbp["level_type"] = vbp["close"].apply(
-        lambda x: "support" if x < last_close else "resistance"
+    is_observed = np.bincount(codes, minlength=bin_amount) > 0
+    positive, negative = positive[is_observed], negative[is_observed]
+    levels = price_bins.categories.left.to_numpy(dtype=np.float64)[is_observed]
+    vbp = pd.DataFrame(
+        {
+            "volume": negative + positive,
+            "negative": negative,
+            "positive": positive,
+            "close": levels,
+            "level_type": np.where(levels < close[-1], "support", "resistance"),
+        }
     )
-    vbp.drop(columns="price_bin", inplace=True)
-    vbp["volume"] = vbp["negative"] + vbp["positive"]
     return vbp.sort_values(by="volume", ascending=False)
@@ -0,0 +1,45 @@
+import asyncio
+
+import ccxt.async_support as ccxt
+
+LOAD_CONCURRENCY = 8
+LOAD_RETRIES = 3
+LOAD_BACKOFF = 1.0
+
+
+class RateLimitedLoader:
+    """
+    Runs exchange requests with at most `concurrency` in flight and their starts
+    spaced by the exchange's ccxt `rateLimit`. Network errors, rate limit errors
+    included, are retried with exponential backoff. Other errors are raised.
+    """
+
+    def __init__(
+        self,
+        rate_limit: float,
+        concurrency: int = LOAD_CONCURRENCY,
+        retries: int = LOAD_RETRIES,
+        backoff: float = LOAD_BACKOFF,
+    ):
+        self.interval = (rate_limit or 0) / 1000
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.next_start = 0
+
+    async def throttle(self):
+        now = asyncio.get_running_loop().time()
+        start = max(now, self.next_start)
+        self.next_start = start + self.interval
+        await asyncio.sleep(start - now)
+
+    async def call(self, request, *args, **kwargs):
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                await self.throttle()
+                try:
+                    return await request(*args, **kwargs)
+                except ccxt.NetworkError:
+                    if attempt == self.retries:
+                        raise
+                    await asyncio.sleep(self.backoff * 2**attempt)
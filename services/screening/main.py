@@ -2,75 +2,110 @@ import asyncio
 import json
 import os
 import sys
-import time
 import warnings
-from datetime import datetime as dt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import ccxt.async_support as ccxt
+import msgpack
 import pandas as pd
-import pandas_ta as ta
 import websockets
-from indicators import technicals
+from loader import RateLimitedLoader
+from ohlcv import OhlcvBuffer, SharedOhlcvStore
+from scoring import (
+    SCORE_COLUMNS,
+    SCORE_DTYPES,
+    SCORING_CHUNK_SIZE,
+    PairScoring,
+    score_shared_pairs,
+)
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
 from utils import helpers
+from utils.ohlcv_cache import OhlcvCache
 
 warnings.filterwarnings("ignore")
 WS_PORT = 8768
+REFRESH_INTERVAL = 1.0
+SCORE_DIFF_HISTORY = 100
+UNAVAILABLE_RETRY_INTERVAL = 30
 LOG = helpers.get_logger("screening_service")
 
 
-class ExchangeScreener:
+class ExchangeScreener(PairScoring):
     def __init__(
         self,
         verbose: bool,
         pairs: dict,
         exchange_object: ccxt.Exchange,
         all_symbols: list,
+        on_update=None,
+        scoring_pool: ProcessPoolExecutor = None,
+        refresh_interval: float = REFRESH_INTERVAL,
     ):
-        self.verbose = verbose
+        super().__init__(verbose)
         self.pairs = pairs
-        self.exchange_name = exchange_object.name.lower()
+        self.exchange_name = exchange_object.id.lower()
         self.exchange_object = exchange_object
         self.clients = set()
         self.all_symbols = all_symbols
-        self.data = dict()
+        self.features = self.get_features_df(list())
         self.scores = pd.DataFrame(columns=["pair"])
-        self.updated = True
+        self.on_update = on_update
+        self.server_ws = None
+        self.scoring_pool = scoring_pool
+        self.ohlcv_store = SharedOhlcvStore(len(pairs)) if scoring_pool else None
+        self.ohlcv_snapshot = SharedOhlcvStore(len(pairs)) if scoring_pool else None
+        self.pool_scoring = asyncio.Lock()
+        self.pair_slots = {pair: slot for slot, pair in enumerate(pairs)}
+        self.refresh_interval = refresh_interval
+        self.dirty_pairs = set()
+        self.pairs_dirty = asyncio.Event()
+        self.loader = RateLimitedLoader(exchange_object.rateLimit)
+        self.ohlcv_cache = OhlcvCache()
+
+    async def get_pairs_by_volume(self) -> list:
+        pairs = list(self.pairs)
+        if not self.exchange_object.has.get("fetchTickers"):
+            return pairs
+        try:
+            tickers = await self.loader.call(self.exchange_object.fetch_tickers, pairs)
+        except Exception as e:
+            LOG.warning(f"Could not rank {self.exchange_name} pairs by volume: \n {e}")
+            return pairs
+        return sorted(
+            pairs,
+            key=lambda pair: tickers.get(pair, dict()).get("quoteVolume") or 0,
+            reverse=True,
+        )
 
     async def load_all_data(self):
-        tasks = list()
-        for pair in self.pairs:
-            tasks += [self.get_pair_ohlcv(pair), self.get_pair_book(pair)]
-        await asyncio.gather(*tasks)
+        """
+        Highest volume pairs first, through the rate limited loader
+        """
+        pairs = await self.get_pairs_by_volume()
+        progress_step = max(1, len(pairs) // 10)
+        loaded_pairs = 0
+
+        async def load_pair(pair: str):
+            nonlocal loaded_pairs
+            await asyncio.gather(self.get_pair_ohlcv(pair), self.get_pair_book(pair))
+            loaded_pairs += 1
+            if loaded_pairs % progress_step == 0 or loaded_pairs == len(pairs):
+                LOG.info(
+                    f"Loaded {loaded_pairs}/{len(pairs)} {self.exchange_name} pairs"
+                )
 
-    async def add_technical_indicators(self, pair: str) -> bool:
-        if self.verbose:
-            LOG.info(f"Computing technical indicators for {pair}")
-        self.data[pair]["ohlcv"].ta.cores = 0
-        CustomStrategy = ta.Strategy(
-            name="Momo and Volatility",
-            description="SMA 50,200, BBANDS, RSI, MACD and Volume SMA 20",
-            ta=[
-                {"kind": "bbands", "length": 20},
-                {"kind": "rsi"},
-                {"kind": "macd", "fast": 8, "slow": 21},
-            ],
-        )
-        try:
-            self.data[pair]["ohlcv"].ta.strategy(CustomStrategy)
-            return True
-        except Exception as e:
-            LOG.warning(f"Could not compute all indicators for {pair}:\n \n {e}")
-            return False
+        await asyncio.gather(*[load_pair(pair) for pair in pairs])
 
     async def get_pair_book(self, pair: str):
         if pair not in self.data:
             self.data[pair] = dict()
         try:
-            self.data[pair]["book"] = await self.exchange_object.fetch_order_book(
-                symbol=pair, limit=100
+            self.data[pair]["book"] = await self.loader.call(
+                self.exchange_object.fetch_order_book, symbol=pair, limit=100
             )
             if self.verbose:
                 LOG.info(f"Downloading Order Book data for {pair}")
@@ -81,232 +116,213 @@ class ExchangeScreener:
         if pair not in self.data:
             self.data[pair] = dict()
         try:
-            ohlc_data = await self.exchange_object.fetch_ohlcv(
-                symbol=pair, timeframe="1d", limit=300
+            ohlc_data = await self.ohlcv_cache.fetch(
+                partial(self.loader.call, self.exchange_object.fetch_ohlcv),
+                self.exchange_name,
+                pair,
+                timeframe="1d",
+                limit=300,
             )
         except Exception as e:
             LOG.warning(f"Could not download OHLCV data for {pair}: \n {e}")
             return
         if self.verbose:
             LOG.info(f"Downloading OHLCV data for {pair}")
-        self.data[pair]["ohlcv"] = pd.DataFrame(
-            data=ohlc_data,
-            columns=["timestamp", "open", "high", "low", "close", "volume"],
+        ohlcv = (
+            self.ohlcv_store.get_buffer(self.pair_slots[pair])
+            if self.ohlcv_store
+            else OhlcvBuffer()
         )
+        ohlcv.load(ohlc_data)
+        self.data[pair]["ohlcv"] = ohlcv
+        self.data[pair]["indicators"] = None
         if self.data[pair]["ohlcv"].empty:
             LOG.warning(f"No OHLCV data for {pair}")
 
+    async def notify_update(self):
+        if self.on_update:
+            await self.on_update()
+
     async def live_refresh(self, raw_data: bytes = None):
-        self.updated = True
         pair = await self.read_ws_message(raw_data)
-        await self.get_scoring([pair])
+        if pair in self.pairs:
+            self.dirty_pairs.add(pair)
+            self.pairs_dirty.set()
+
+    async def refresh_dirty_pairs(self):
+        """
+        Rescores the pairs touched since the previous cycle, then ranks and
+        notifies once. Cycles are at least `refresh_interval` apart, so a burst of
+        messages on one pair costs a single rescoring.
+        """
+        while True:
+            await self.pairs_dirty.wait()
+            self.pairs_dirty.clear()
+            pairs, self.dirty_pairs = self.dirty_pairs, set()
+            try:
+                await self.get_scoring(list(pairs))
+                await self.notify_update()
+                if self.verbose:
+                    self.log_scores()
+            except Exception as e:
+                LOG.warning(f"Could not rescore {self.exchange_name} pairs: \n {e}")
+            await asyncio.sleep(self.refresh_interval)
 
     async def update_pair_ohlcv(self, pair: str, data: dict):
         trade = data["trades"]
-        ohlcv = self.data[pair]["ohlcv"]
-        ohlcv["timestamp"] = ohlcv["timestamp"] / 1000
-        trade_timestamp = dt.utcfromtimestamp(trade["timestamp"]).date()
-        latest_ohlcv_timestamp = dt.utcfromtimestamp(ohlcv["timestamp"].iloc[-1]).date()
-        if trade_timestamp > latest_ohlcv_timestamp:
-            new_row = pd.DataFrame(
-                [
-                    [
-                        trade["timestamp"],
-                        trade["price"],
-                        trade["price"],
-                        trade["price"],
-                        trade["price"],
-                        trade["amount"],
-                    ]
-                ],
-                columns=["timestamp", "open", "high", "low", "close", "volume"],
-            )
-            ohlcv = pd.concat([ohlcv, new_row])
-        else:
-            idx = ohlcv.index[len(ohlcv) - 1]
-            ohlcv.loc[idx, "timestamp"] = time.time()
-            ohlcv.loc[idx, "high"] = max(ohlcv.loc[idx, "high"], trade["price"])
-            ohlcv.loc[idx, "low"] = min(ohlcv.loc[idx, "low"], trade["price"])
-            ohlcv.loc[idx, "close"] = trade["price"]
-            ohlcv.loc[idx, "volume"] += trade["amount"]
-        self.data[pair]["ohlcv"] = ohlcv
+        ohlcv = self.data[pair].get("ohlcv")
+        if ohlcv is None:
+            return
+        last_close = None if ohlcv.empty else ohlcv.last("close")
+        is_new_candle = ohlcv.add_trade(
+            trade["price"], trade["amount"], trade["timestamp"]
+        )
+        indicators = self.data[pair].get("indicators")
+        if is_new_candle and indicators is not None and last_close is not None:
+            indicators.commit(last_close)
 
-    async def read_ws_message(self, raw_data: bytes) -> str:
-        data = json.loads(raw_data)
+    async def read_ws_message(self, raw_data: str or bytes) -> str:
+        data = helpers.decode_ws_message(raw_data)
         for method in data:
             pair = data[method]["symbol"].replace("-", "/")
             if pair in self.pairs:
                 if method == "trades":
                     await self.update_pair_ohlcv(pair, data)
                 if method == "book":
-                    self.data[pair]["book"] = data[method][method]
+                    self.data[pair]["book"] = {
+                        side: {float(price): size for price, size in levels.items()}
+                        for side, levels in data[method][method].items()
+                    }
+                    self.data[pair]["book_sequence"] = data[method]["sequence"]
+                if method == "book_delta":
+                    await self.apply_book_delta(pair, data[method])
             return pair
 
-    def get_book_scoring(self, pair: str, scoring: dict) -> dict:
-        data = dict()
-        if "book" not in self.data[pair]:
-            return dict(book_imbalance=None, spread=None)
-        pair_book = self.data[pair]["book"]
-        for side in ("bid", "ask"):
-            raw_side = side if side in pair_book else side + "s"
-            if isinstance(pair_book[raw_side], list):
-                df = pd.DataFrame(pair_book[raw_side], columns=["price", "volume"])
-                df.set_index("price", inplace=True)
-            else:
-                df = pd.DataFrame.from_dict(
-                    pair_book[raw_side], orient="index", columns=["volume"]
-                )
-            mask = (
-                df.index <= scoring["next_resistance"]
-                if side == "ask"
-                else df.index >= scoring["next_support"]
-            )
-            df = df[mask]
-            if df.empty:
-                return dict(book_imbalance=None, spread=None)
-            data[side] = df
-        spread = (float(data["ask"].index[0]) / float(data["bid"].index[0])) - 1
-        book_imbalance = (data["bid"]["volume"].sum() / data["ask"]["volume"].sum()) - 1
-        return dict(book_imbalance=book_imbalance, spread=spread)
-
-    def technical_indicators_scoring(
-        self, scoring: dict, pair: str, is_scorable: bool
-    ) -> tuple[dict, bool]:
-        ohlcv = self.data[pair]["ohlcv"]
-        if not ohlcv.empty:
-            scoring["close"] = ohlcv["close"].iloc[-1]
-            scoring["24h_change"] = scoring["close"] / ohlcv["open"].iloc[-1] - 1
-        else:
-            scoring["close"] = None
-            scoring["24h_change"] = None
-            is_scorable = False
-        if "RSI_14" in ohlcv.columns and is_scorable:
-            scoring["rsi"] = int(ohlcv["RSI_14"].iloc[-1])
-        else:
-            is_scorable = False
-            scoring["rsi"] = None
-        if "BBL_20_2.0" in ohlcv.columns.tolist() and is_scorable:
-            scoring["bbl"] = (scoring["close"] / ohlcv["BBL_20_2.0"].iloc[-1]) - 1
-        else:
-            is_scorable = False
-            scoring["bbl"] = None
-        return scoring, is_scorable
-
-    def vbp_based_scoring(
-        self, pair: str, scoring: dict, is_scorable: bool
-    ) -> tuple[dict, bool]:
-        if is_scorable:
-            ohlcv = self.data[pair]["ohlcv"]
-            ohlcv["usd_volume"] = ohlcv.apply(
-                lambda x: x["volume"] * x["close"], axis=1
-            )
-            scoring["usd_volume"] = ohlcv["usd_volume"].sum()
-            total_volume = ohlcv["volume"].sum()
-            vbp = technicals.get_vbp(ohlcv)
-            fractals = technicals.FractalCandlestickPattern(
-                self.data[pair]["ohlcv"]
-            ).run()
-            fractal_resistances = sorted(
-                [fractal for fractal in fractals if fractal > scoring["close"]]
-            )
-            supports = vbp[vbp["level_type"] == "support"].reset_index(drop=True)
-            resistances = vbp[vbp["level_type"] == "resistance"].reset_index(drop=True)
-            if len(supports) < 2 or resistances.empty or not fractal_resistances:
-                is_scorable = False
-            scoring["next_support"] = supports.loc[0, "close"] if is_scorable else None
-            scoring["support_strength"] = (
-                supports.loc[0, "volume"] / total_volume if is_scorable else None
-            )
-            scoring["next_resistance"] = (
-                min(resistances.loc[0, "close"], fractal_resistances[0])
-                if is_scorable
-                else None
+    async def apply_book_delta(self, pair: str, delta: dict):
+        sequence = self.data[pair].get("book_sequence")
+        if sequence is None:
+            return
+        if delta["sequence"] != sequence + 1:
+            self.data[pair]["book_sequence"] = None
+            await self.server_ws.send(json.dumps({"snapshot": [delta["symbol"]]}))
+            return
+        for side, levels in delta["delta"].items():
+            for price, size in levels.items():
+                if size:
+                    self.data[pair]["book"][side][float(price)] = size
+                else:
+                    self.data[pair]["book"][side].pop(float(price), None)
+        self.data[pair]["book_sequence"] = delta["sequence"]
+
+    @staticmethod
+    def get_features_df(rows: list) -> pd.DataFrame:
+        """
+        Scoring rows with float numeric columns, unscorable values as NaN, so that
+        patching a row never changes a column's dtype
+        """
+        features = pd.DataFrame.from_records(rows, columns=SCORE_COLUMNS).astype(
+            SCORE_DTYPES
+        )
+        features.index = features["pair"].tolist()
+        return features
+
+    def update_features(self, rows: list, removed_pairs: list):
+        """
+        Patches the rows of already scored pairs in place, appends new pairs once
+        """
+        features = self.features.drop(
+            index=[pair for pair in removed_pairs if pair in self.features.index]
+        )
+        patched_rows = [row for row in rows if row["pair"] in features.index]
+        new_rows = [row for row in rows if row["pair"] not in features.index]
+        if patched_rows:
+            patch = self.get_features_df(patched_rows)
+            features.loc[patch.index] = patch
+        if new_rows:
+            new_features = self.get_features_df(new_rows)
+            features = (
+                pd.concat([features, new_features]) if len(features) else new_features
             )
-            stop_loss_df = (
-                supports[supports["close"] < scoring["next_support"]].reset_index(
-                    drop=True
+        self.features = features
+
+    def rank_scores(self):
+        scores = self.features.drop(columns="base_score")
+        usd_volume = pd.to_numeric(scores["usd_volume"], errors="coerce")
+        scores["score"] = (
+            pd.to_numeric(self.features["base_score"]) + usd_volume / usd_volume.max()
+        )
+        self.scores = scores.sort_values(by="score", ascending=False)
+
+    @staticmethod
+    def get_book_levels(book: dict or None) -> dict or None:
+        """
+        Copy of the book levels, which live updates keep mutating
+        """
+        if book is None:
+            return None
+        return {
+            side: list(levels.items()) if isinstance(levels, dict) else list(levels)
+            for side, levels in book.items()
+            if side in ("bid", "ask", "bids", "asks")
+        }
+
+    async def score_in_pool(self) -> list:
+        """
+        Full rescoring sharded over the scoring processes. The event loop keeps
+        serving and updating the live candles and books meanwhile, so the workers
+        read a snapshot of them: candles copied at once into a second shared store,
+        book levels copied into the tasks.
+        """
+        async with self.pool_scoring:
+            self.ohlcv_snapshot.candles[:] = self.ohlcv_store.candles
+            tasks = [
+                (
+                    pair,
+                    self.pair_slots[pair],
+                    self.data[pair]["ohlcv"].count,
+                    self.get_book_levels(self.data[pair].get("book")),
                 )
-                if is_scorable
-                else pd.DataFrame()
-            )
-            if stop_loss_df.empty:
-                is_scorable = False
-            scoring["stop_loss"] = (
-                stop_loss_df.iloc[0]["close"] if is_scorable else None
-            )
-            scoring["supports"] = (
-                [scoring["next_support"], scoring["stop_loss"]] if is_scorable else None
-            )
-            scoring["resistances"] = (
-                [scoring["next_resistance"]] if is_scorable else None
-            )
-            scoring["upside"] = (
-                scoring["next_resistance"] / scoring["next_support"] - 1
-                if is_scorable
-                else None
-            )
-            scoring["downside"] = (
-                scoring["next_support"] / scoring["stop_loss"] - 1
-                if is_scorable
-                else None
-            )
-            scoring["risk_reward_ratio"] = (
-                scoring["upside"] / scoring["downside"] - 1 if is_scorable else None
+                for pair in self.pairs
+                if self.data.get(pair, dict()).get("ohlcv") is not None
+            ]
+            loop = asyncio.get_running_loop()
+            shards = await asyncio.gather(
+                *[
+                    loop.run_in_executor(
+                        self.scoring_pool,
+                        score_shared_pairs,
+                        self.ohlcv_snapshot.name,
+                        len(self.pairs),
+                        tasks[idx : idx + SCORING_CHUNK_SIZE],
+                    )
+                    for idx in range(0, len(tasks), SCORING_CHUNK_SIZE)
+                ]
             )
-            scoring["distance_to_support"] = (
-                scoring["close"] / scoring["next_support"] - 1 if is_scorable else None
-            )
-            scoring["distance_to_resistance"] = (
-                scoring["next_resistance"] / scoring["close"] - 1
-                if is_scorable
-                else None
-            )
-            if (
-                is_scorable
-                and scoring["distance_to_resistance"] < scoring["distance_to_support"]
-            ):
-                is_scorable = False
-        return scoring, is_scorable
-
-    async def score_pair(self, pair: str):
-        self.scores = self.scores[self.scores["pair"] != pair]
-        if pair not in self.data:
-            self.data[pair] = dict()
-        if self.data[pair].get("ohlcv") is not None:
-            scoring = dict()
-            is_scorable = await self.add_technical_indicators(pair)
-            scoring, is_scorable = self.technical_indicators_scoring(
-                scoring, pair, is_scorable
-            )
-            scoring, is_scorable = self.vbp_based_scoring(pair, scoring, is_scorable)
-            if is_scorable:
-                book_score_details = self.get_book_scoring(pair, scoring)
-                scoring = {**scoring, **book_score_details}
-                scoring["score"] = (
-                    scoring["risk_reward_ratio"]
-                    + scoring["support_strength"]
-                    + (1 - (scoring["rsi"] / 100))
-                    + (1 - scoring["bbl"])
-                    + (1 - scoring["distance_to_support"])
-                )
-            else:
-                scoring["score"] = 0
-            scoring["pair"] = pair
-            pair_score_df = pd.DataFrame([scoring])
-            if not pair_score_df.empty:
-                self.scores = pd.concat([self.scores, pair_score_df])
+        return [row for shard in shards for row in shard]
+
+    def close(self):
+        if self.ohlcv_store:
+            self.data.clear()
+            self.ohlcv_store.close(unlink=True)
+            self.ohlcv_snapshot.close(unlink=True)
 
     async def get_scoring(self, pairs_to_screen: list = None):
-        pairs_to_screen = pairs_to_screen if pairs_to_screen else self.pairs
-        tasks = [self.score_pair(pair) for pair in pairs_to_screen]
-        await asyncio.gather(*tasks)
-        if not self.scores.empty:
-            self.scores["score"] = self.scores.apply(
-                lambda x: x["score"]
-                + (x["usd_volume"] / self.scores["usd_volume"].max()),
-                axis=1,
+        if pairs_to_screen:
+            rows = [self.score_pair(pair) for pair in pairs_to_screen]
+            self.update_features(
+                [row for row in rows if row is not None],
+                [pair for pair, row in zip(pairs_to_screen, rows) if row is None],
+            )
+        else:
+            rows = (
+                await self.score_in_pool()
+                if self.scoring_pool
+                else [self.score_pair(pair) for pair in self.pairs]
+            )
+            self.features = self.get_features_df(
+                [row for row in rows if row is not None]
             )
-            self.scores.sort_values(by="score", ascending=False, inplace=True)
+        self.rank_scores()
 
     def log_scores(self, top_score_amount: int = 10):
         if self.scores is not None:
@@ -315,38 +331,41 @@ class ExchangeScreener:
 
     async def get_ws_uri(self) -> str:
         pair_str = ",".join(self.all_symbols)
-        return f"{helpers.BASE_WS}{WS_PORT}?exchange={self.exchange_name}?trades={pair_str}?book={pair_str}"
+        return f"{helpers.BASE_WS}{WS_PORT}?exchange={self.exchange_name}?trades={pair_str}?book={pair_str}?format=msgpack"
 
     async def handle_unavailable_server(self):
-        LOG.error("The Real Time Data service is down.")
-        while True:
-            self.updated = True
-            await self.load_all_data()
-            await self.get_scoring()
-            await asyncio.sleep(0)
+        LOG.error(
+            f"The Real Time Data service is down, retrying in "
+            f"{UNAVAILABLE_RETRY_INTERVAL}s with refreshed {self.exchange_name} data."
+        )
+        await asyncio.sleep(UNAVAILABLE_RETRY_INTERVAL)
+        await self.load_all_data()
+        await self.get_scoring()
+        await self.notify_update()
 
     async def screen_exchange(self):
         uri = await self.get_ws_uri()
         await self.load_all_data()
         await self.get_scoring()
+        await self.notify_update()
+        refresh_task = asyncio.create_task(self.refresh_dirty_pairs())
         try:
-            async with websockets.connect(uri, ping_interval=None) as server_ws:
-                while True:
-                    try:
-                        response = await server_ws.recv()
-                        if response != "heartbeat":
-                            await self.live_refresh(response)
-                            if self.verbose:
-                                self.log_scores()
-                    except (
-                        websockets.ConnectionClosedError or asyncio.IncompleteReadError
-                    ):
-                        await self.exchange_object.close()
-                        await self.handle_unavailable_server()
-                        break
-                    await asyncio.sleep(0)
-        except ConnectionRefusedError:
-            await self.handle_unavailable_server()
+            while True:
+                try:
+                    async with websockets.connect(uri, ping_interval=None) as server_ws:
+                        self.server_ws = server_ws
+                        while True:
+                            response = await server_ws.recv()
+                            if response != "heartbeat":
+                                await self.live_refresh(response)
+                except (
+                    OSError,
+                    websockets.ConnectionClosed,
+                    asyncio.IncompleteReadError,
+                ):
+                    await self.handle_unavailable_server()
+        finally:
+            refresh_task.cancel()
 
 
 class Screener:
@@ -356,13 +375,25 @@ class Screener:
         ref_currency: str = "USD",
         verbose: bool = False,
         user_symbols_list: list = None,
+        scoring_workers: int = 0,
+        refresh_interval: float = REFRESH_INTERVAL,
     ):
         self.ref_currency = ref_currency
         self.verbose = verbose
         self.user_symbols_list = user_symbols_list
         self.exchange_list = exchange_list if exchange_list else ccxt.exchanges
         self.data = dict()
-        self.all_symbols = list()
+        self.screeners = dict()
+        self.scores = pd.DataFrame(columns=["exchange", "pair"])
+        self.scores_version = 0
+        self.scores_updated = asyncio.Condition()
+        self.score_rows = dict()
+        self.score_diffs = deque(maxlen=SCORE_DIFF_HISTORY)
+        self.encoded_snapshots = dict()
+        self.scoring_pool = (
+            ProcessPoolExecutor(scoring_workers) if scoring_workers else None
+        )
+        self.refresh_interval = refresh_interval
 
     async def is_pair_in_scope(self, details: dict) -> bool:
         if not self.user_symbols_list or details["id"] in self.user_symbols_list:
@@ -375,24 +406,109 @@ class Screener:
             exchange_object = helpers.get_exchange_object(exchange, async_mode=True)
             symbols = await exchange_object.load_markets()
             filtered_symbols = dict()
+            ws_symbols = list()
             for symbol, details in symbols.items():
                 if await self.is_pair_in_scope(details):
                     filtered_symbols[symbol] = details
-                    if details["id"] not in self.all_symbols:
-                        self.all_symbols.append(details["id"])
-            self.data[exchange] = dict(mapping=filtered_symbols, object=exchange_object)
+                    ws_symbols.append(symbol.replace("/", "-"))
+            self.data[exchange] = dict(
+                mapping=filtered_symbols, object=exchange_object, symbols=ws_symbols
+            )
 
     async def run_screening(self):
         await self.get_exchanges_mappings()
         for exchange, details in self.data.items():
-            self.screener = ExchangeScreener(
-                self.verbose, details["mapping"], details["object"], self.all_symbols
+            self.screeners[exchange] = ExchangeScreener(
+                self.verbose,
+                details["mapping"],
+                details["object"],
+                details["symbols"],
+                on_update=self.notify_clients,
+                scoring_pool=self.scoring_pool,
+                refresh_interval=self.refresh_interval,
             )
-            await self.screener.screen_exchange()
-
-    async def safe_send_to_clients(self, client_ws) -> bool:
-        self.screener.updated = False
-        ws_data = self.screener.scores.to_json(orient="records")
+        try:
+            await asyncio.gather(
+                *[screener.screen_exchange() for screener in self.screeners.values()]
+            )
+        finally:
+            for screener in self.screeners.values():
+                screener.close()
+            if self.scoring_pool:
+                self.scoring_pool.shutdown(cancel_futures=True)
+
+    def merge_scores(self) -> pd.DataFrame:
+        exchange_scores = [
+            screener.scores.assign(exchange=exchange)
+            for exchange, screener in self.screeners.items()
+            if not screener.scores.empty
+        ]
+        if not exchange_scores:
+            return pd.DataFrame(columns=["exchange", "pair"])
+        scores = pd.concat(exchange_scores, ignore_index=True)
+        return scores.sort_values(by="score", ascending=False)
+
+    @staticmethod
+    def get_score_rows(scores: pd.DataFrame) -> dict:
+        return {
+            f"{row['exchange']}:{row['pair']}": row
+            for row in json.loads(scores.to_json(orient="records"))
+        }
+
+    @staticmethod
+    def encode(message: dict, wire_format: str) -> str or bytes:
+        if wire_format == "msgpack":
+            return msgpack.packb(message)
+        return json.dumps(message)
+
+    async def notify_clients(self):
+        scores = self.merge_scores()
+        score_rows = self.get_score_rows(scores)
+        changed = [
+            row for key, row in score_rows.items() if self.score_rows.get(key) != row
+        ]
+        removed = [key for key in self.score_rows if key not in score_rows]
+        if not changed and not removed:
+            return
+        async with self.scores_updated:
+            self.scores = scores
+            self.score_rows = score_rows
+            self.scores_version += 1
+            diff = dict(version=self.scores_version, changed=changed, removed=removed)
+            self.score_diffs.append((self.scores_version, diff, dict()))
+            self.encoded_snapshots = dict()
+            self.scores_updated.notify_all()
+
+    def get_snapshot(self, wire_format: str) -> str or bytes:
+        if wire_format not in self.encoded_snapshots:
+            snapshot = dict(
+                version=self.scores_version, snapshot=list(self.score_rows.values())
+            )
+            self.encoded_snapshots[wire_format] = self.encode(snapshot, wire_format)
+        return self.encoded_snapshots[wire_format]
+
+    def get_client_messages(self, sent_version: int, wire_format: str) -> list:
+        """
+        Diffs since `sent_version`, each encoded once per wire format, or a full
+        snapshot for new clients and clients that fell behind the diff history
+        """
+        if sent_version is None or not self.score_diffs:
+            return [self.get_snapshot(wire_format)]
+        if self.score_diffs[0][0] > sent_version + 1:
+            return [self.get_snapshot(wire_format)]
+        messages = list()
+        for version, diff, encoded in self.score_diffs:
+            if version > sent_version:
+                if wire_format not in encoded:
+                    encoded[wire_format] = self.encode(diff, wire_format)
+                messages.append(encoded[wire_format])
+        return messages
+
+    @staticmethod
+    def get_wire_format(client_ws) -> str:
+        return "msgpack" if "format=msgpack" in client_ws.request.path else "json"
+
+    async def safe_send_to_clients(self, client_ws, ws_data: str or bytes) -> bool:
         try:
             await client_ws.send(ws_data)
             return True
@@ -402,23 +518,33 @@ class Screener:
             return False
 
     async def run_client_websocket(self, client_ws):
-        self.screener.updated = True
         LOG.info(
             f"New client connected to screening service - session ID: {client_ws.id}"
         )
+        wire_format = self.get_wire_format(client_ws)
         client_is_connected = True
-        if not self.screener.scores.empty:
-            client_is_connected = await self.safe_send_to_clients(client_ws)
-        while True:
-            if not self.screener.scores.empty and self.screener.updated:
-                client_is_connected = await self.safe_send_to_clients(client_ws)
-            if not client_is_connected:
-                break
-            await asyncio.sleep(0)
+        sent_version = None
+        while client_is_connected:
+            async with self.scores_updated:
+                await self.scores_updated.wait_for(
+                    lambda: self.scores_version != sent_version
+                )
+                messages = self.get_client_messages(sent_version, wire_format)
+                sent_version = self.scores_version
+            for ws_data in messages:
+                client_is_connected = await self.safe_send_to_clients(
+                    client_ws, ws_data
+                )
+                if not client_is_connected:
+                    break
 
 
 async def run_websocket():
-    screener = Screener(exchange_list=["coinbase"], verbose=True)
+    screener = Screener(
+        exchange_list=["coinbase"],
+        verbose=True,
+        scoring_workers=max(1, os.cpu_count() - 1),
+    )
     screening_task = asyncio.create_task(screener.run_screening())
     start_server = websockets.serve(screener.run_client_websocket, "localhost", 8795)
     await asyncio.gather(screening_task, start_server)
@@ -0,0 +1,127 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+COLUMNS = ("timestamp", "open", "high", "low", "close", "volume")
+COLUMN_INDEX = {column: idx for idx, column in enumerate(COLUMNS)}
+OHLCV_CAPACITY = 300
+DAY_SECONDS = 86400
+
+
+class OhlcvBuffer:
+    """
+    Fixed capacity columnar OHLCV ring. Every row is written twice, at its slot and
+    at slot + capacity, so the latest `capacity` candles are always one contiguous
+    slice of the backing array: appending is O(1) and `column` returns views
+    without copying. Timestamps are stored in seconds.
+    """
+
+    def __init__(
+        self, capacity: int = OHLCV_CAPACITY, data: np.ndarray = None, count: int = 0
+    ):
+        self.capacity = capacity
+        self.data = (
+            data
+            if data is not None
+            else np.zeros((len(COLUMNS), 2 * capacity), dtype=np.float64)
+        )
+        self.count = count
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    @property
+    def empty(self) -> bool:
+        return self.count == 0
+
+    def get_window(self) -> slice:
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        return slice(end - len(self), end)
+
+    def load(self, rows: list, timestamp_unit: float = 1000):
+        """
+        Replaces the content with ccxt style [timestamp, open, high, low, close,
+        volume] rows, timestamps in `timestamp_unit` per second
+        """
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(COLUMNS))
+        rows = rows[-self.capacity :]
+        size = len(rows)
+        self.data[:, :size] = rows.T
+        self.data[:, self.capacity : self.capacity + size] = rows.T
+        self.data[COLUMN_INDEX["timestamp"], :] /= timestamp_unit
+        self.count = size
+
+    def write_row(self, slot: int, row: tuple):
+        for idx, value in enumerate(row):
+            self.data[idx, slot] = value
+            self.data[idx, slot + self.capacity] = value
+
+    def append(self, row: tuple):
+        self.write_row(self.count % self.capacity, row)
+        self.count += 1
+
+    def update_last(self, price: float, amount: float):
+        slot = (self.count - 1) % self.capacity
+        high, low, close, volume = (
+            COLUMN_INDEX[column] for column in ("high", "low", "close", "volume")
+        )
+        row = self.data[:, slot]
+        row[high] = max(row[high], price)
+        row[low] = min(row[low], price)
+        row[close] = price
+        row[volume] += amount
+        self.data[:, slot + self.capacity] = row
+
+    def add_trade(self, price: float, amount: float, timestamp: float) -> bool:
+        """
+        Folds a trade into the live daily candle, or opens a new one when the trade
+        belongs to a later day. Returns whether a new candle was opened.
+        """
+        candle_start = timestamp - timestamp % DAY_SECONDS
+        if self.empty or candle_start > self.last("timestamp"):
+            self.append((candle_start, price, price, price, price, amount))
+            return True
+        self.update_last(price, amount)
+        return False
+
+    def column(self, column: str) -> np.ndarray:
+        return self.data[COLUMN_INDEX[column], self.get_window()]
+
+    def last(self, column: str) -> float:
+        return float(self.data[COLUMN_INDEX[column], (self.count - 1) % self.capacity])
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.column(column)
+
+
+class SharedOhlcvStore:
+    """
+    OhlcvBuffer arrays of many pairs in one shared memory block, one slot per pair,
+    so that scoring processes can attach to the candles instead of receiving them
+    pickled. Readers only see the candles up to the count they were given.
+    """
+
+    def __init__(
+        self, pair_amount: int, capacity: int = OHLCV_CAPACITY, name: str = None
+    ):
+        self.capacity = capacity
+        shape = (max(pair_amount, 1), len(COLUMNS), 2 * capacity)
+        self.shm = shared_memory.SharedMemory(
+            name=name,
+            create=name is None,
+            size=int(np.prod(shape)) * np.dtype(np.float64).itemsize,
+        )
+        self.candles = np.ndarray(shape, dtype=np.float64, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def get_buffer(self, slot: int, count: int = 0) -> OhlcvBuffer:
+        return OhlcvBuffer(self.capacity, data=self.candles[slot], count=count)
+
+    def close(self, unlink: bool = False):
+        self.candles = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
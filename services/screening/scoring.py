@@ -0,0 +1,236 @@
+import math
+import os
+import sys
+
+import numpy as np
+from indicators import technicals
+from indicators.incremental import IncrementalIndicators
+from ohlcv import SharedOhlcvStore
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from utils import helpers
+
+LOG = helpers.get_logger("screening_service")
+SCORING_CHUNK_SIZE = 25
+SCORE_COLUMNS = [
+    "pair",
+    "close",
+    "24h_change",
+    "rsi",
+    "bbl",
+    "usd_volume",
+    "next_support",
+    "support_strength",
+    "next_resistance",
+    "stop_loss",
+    "supports",
+    "resistances",
+    "upside",
+    "downside",
+    "risk_reward_ratio",
+    "distance_to_support",
+    "distance_to_resistance",
+    "book_imbalance",
+    "spread",
+    "base_score",
+]
+SCORE_DTYPES = {
+    column: object if column in ("pair", "supports", "resistances") else "float64"
+    for column in SCORE_COLUMNS
+}
+
+
+class PairScoring:
+    """
+    Per pair scoring from the OHLCV, indicators and book held in `data`. Shared by
+    the screener itself and the scoring pool workers.
+    """
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        self.data = dict()
+
+    def add_technical_indicators(self, pair: str) -> bool:
+        ohlcv = self.data[pair]["ohlcv"]
+        if ohlcv.empty:
+            return False
+        indicators = self.data[pair].get("indicators")
+        if indicators is None:
+            if self.verbose:
+                LOG.info(f"Computing technical indicators for {pair}")
+            indicators = IncrementalIndicators()
+            self.data[pair]["indicators"] = indicators
+            self.data[pair]["indicator_values"] = indicators.seed(
+                ohlcv.column("close").tolist()
+            )
+        else:
+            self.data[pair]["indicator_values"] = indicators.update(ohlcv.last("close"))
+        return True
+
+    def get_book_scoring(self, pair: str, scoring: dict) -> dict:
+        data = dict()
+        if "book" not in self.data[pair]:
+            return dict(book_imbalance=None, spread=None)
+        pair_book = self.data[pair]["book"]
+        for side in ("bid", "ask"):
+            raw_side = side if side in pair_book else side + "s"
+            levels = pair_book[raw_side]
+            levels = list(levels.items()) if isinstance(levels, dict) else levels
+            if not len(levels):
+                return dict(book_imbalance=None, spread=None)
+            levels = np.asarray(levels, dtype=np.float64).reshape(len(levels), -1)
+            prices, volumes = levels[:, 0], levels[:, 1]
+            mask = (
+                prices <= scoring["next_resistance"]
+                if side == "ask"
+                else prices >= scoring["next_support"]
+            )
+            if not mask.any():
+                return dict(book_imbalance=None, spread=None)
+            best_price = prices[mask].min() if side == "ask" else prices[mask].max()
+            data[side] = (best_price, volumes[mask].sum())
+        spread = (data["ask"][0] / data["bid"][0]) - 1
+        book_imbalance = (data["bid"][1] / data["ask"][1]) - 1
+        return dict(book_imbalance=book_imbalance, spread=spread)
+
+    def technical_indicators_scoring(
+        self, scoring: dict, pair: str, is_scorable: bool
+    ) -> tuple[dict, bool]:
+        ohlcv = self.data[pair]["ohlcv"]
+        if not ohlcv.empty:
+            scoring["close"] = ohlcv.last("close")
+            open_price = ohlcv.last("open")
+            scoring["24h_change"] = (
+                scoring["close"] / open_price - 1 if open_price else None
+            )
+        else:
+            scoring["close"] = None
+            scoring["24h_change"] = None
+            is_scorable = False
+        indicator_values = self.data[pair].get("indicator_values", dict())
+        rsi = indicator_values.get("RSI_14", math.nan)
+        bbl = indicator_values.get("BBL_20_2.0", math.nan)
+        if not math.isnan(rsi) and is_scorable:
+            scoring["rsi"] = int(rsi)
+        else:
+            is_scorable = False
+            scoring["rsi"] = None
+        if not math.isnan(bbl) and is_scorable:
+            scoring["bbl"] = (scoring["close"] / bbl) - 1
+        else:
+            is_scorable = False
+            scoring["bbl"] = None
+        return scoring, is_scorable
+
+    def vbp_based_scoring(
+        self, pair: str, scoring: dict, is_scorable: bool
+    ) -> tuple[dict, bool]:
+        if is_scorable:
+            ohlcv = self.data[pair]["ohlcv"]
+            volume = ohlcv.column("volume")
+            scoring["usd_volume"] = float(np.dot(volume, ohlcv.column("close")))
+            total_volume = volume.sum()
+            vbp = technicals.get_vbp(ohlcv)
+            fractals = technicals.FractalCandlestickPattern(ohlcv).run()
+            fractal_resistances = sorted(
+                [fractal for fractal in fractals if fractal > scoring["close"]]
+            )
+            levels = vbp["close"].to_numpy()
+            is_support = (vbp["level_type"] == "support").to_numpy()
+            supports = levels[is_support]
+            support_volumes = vbp["volume"].to_numpy()[is_support]
+            resistances = levels[~is_support]
+            if len(supports) < 2 or not len(resistances) or not fractal_resistances:
+                is_scorable = False
+            scoring["next_support"] = supports[0] if is_scorable else None
+            scoring["support_strength"] = (
+                support_volumes[0] / total_volume if is_scorable else None
+            )
+            scoring["next_resistance"] = (
+                min(resistances[0], fractal_resistances[0]) if is_scorable else None
+            )
+            stop_losses = (
+                supports[supports < scoring["next_support"]]
+                if is_scorable
+                else supports[:0]
+            )
+            if not len(stop_losses):
+                is_scorable = False
+            scoring["stop_loss"] = stop_losses[0] if is_scorable else None
+            scoring["supports"] = (
+                [scoring["next_support"], scoring["stop_loss"]] if is_scorable else None
+            )
+            scoring["resistances"] = (
+                [scoring["next_resistance"]] if is_scorable else None
+            )
+            scoring["upside"] = (
+                scoring["next_resistance"] / scoring["next_support"] - 1
+                if is_scorable
+                else None
+            )
+            scoring["downside"] = (
+                scoring["next_support"] / scoring["stop_loss"] - 1
+                if is_scorable
+                else None
+            )
+            scoring["risk_reward_ratio"] = (
+                scoring["upside"] / scoring["downside"] - 1 if is_scorable else None
+            )
+            scoring["distance_to_support"] = (
+                scoring["close"] / scoring["next_support"] - 1 if is_scorable else None
+            )
+            scoring["distance_to_resistance"] = (
+                scoring["next_resistance"] / scoring["close"] - 1
+                if is_scorable
+                else None
+            )
+            if (
+                is_scorable
+                and scoring["distance_to_resistance"] < scoring["distance_to_support"]
+            ):
+                is_scorable = False
+        return scoring, is_scorable
+
+    def score_pair(self, pair: str) -> dict or None:
+        if pair not in self.data:
+            self.data[pair] = dict()
+        if self.data[pair].get("ohlcv") is None:
+            return None
+        scoring = dict(pair=pair)
+        is_scorable = self.add_technical_indicators(pair)
+        scoring, is_scorable = self.technical_indicators_scoring(
+            scoring, pair, is_scorable
+        )
+        scoring, is_scorable = self.vbp_based_scoring(pair, scoring, is_scorable)
+        if is_scorable:
+            book_score_details = self.get_book_scoring(pair, scoring)
+            scoring = {**scoring, **book_score_details}
+            scoring["base_score"] = (
+                scoring["risk_reward_ratio"]
+                + scoring["support_strength"]
+                + (1 - (scoring["rsi"] / 100))
+                + (1 - scoring["bbl"])
+                + (1 - scoring["distance_to_support"])
+            )
+        else:
+            scoring["base_score"] = 0.0
+        return scoring
+
+
+def score_shared_pairs(store_name: str, pair_amount: int, tasks: list) -> list:
+    """
+    Process pool entry point. `tasks` holds (pair, slot, candle count, book) tuples,
+    the candles themselves are read from the shared OHLCV store.
+    """
+    store = SharedOhlcvStore(pair_amount, name=store_name)
+    scorer = PairScoring()
+    try:
+        for pair, slot, count, book in tasks:
+            scorer.data[pair] = dict(ohlcv=store.get_buffer(slot, count))
+            if book is not None:
+                scorer.data[pair]["book"] = book
+        return [scorer.score_pair(pair) for pair, _, _, _ in tasks]
+    finally:
+        scorer.data.clear()
+        store.close()
@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 from datetime import datetime as dt
@@ -7,6 +8,7 @@ import aiohttp
 import ccxt
 import django
 import environ
+import msgpack
 import pandas as pd
 import sqlalchemy as sql
 from ccxt import async_support as async_ccxt
@@ -76,6 +78,12 @@ async def async_get(session: aiohttp.ClientSession, url: str, pair: str = None)
         return data
 
 
+def decode_ws_message(raw_data: str or bytes) -> dict:
+    if isinstance(raw_data, bytes):
+        return msgpack.unpackb(raw_data, strict_map_key=False)
+    return json.loads(raw_data)
+
+
 def get_logger(logger_name: str) -> logging.Logger:
     logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     logger = logging.getLogger(logger_name)
@@ -0,0 +1,78 @@
+import os
+import time
+from pathlib import Path
+
+import ccxt
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+OHLCV_CACHE_DIR = Path(os.getenv("OHLCV_CACHE_DIR", BASE_DIR / "data" / "ohlcv"))
+MAX_CACHED_CANDLES = 5000
+COLUMN_AMOUNT = 6
+
+
+class OhlcvCache:
+    """
+    On-disk OHLCV history, one .npy file of [timestamp, open, high, low, close,
+    volume] rows per exchange / pair / timeframe, read memory-mapped. Only the
+    candles from the last stored one onwards are requested from the exchange, the
+    last stored candle being possibly still open.
+    """
+
+    def __init__(self, directory: Path = OHLCV_CACHE_DIR):
+        self.directory = Path(directory)
+
+    def get_path(self, exchange: str, pair: str, timeframe: str) -> Path:
+        file_name = f"{pair.replace('/', '-').replace(':', '_')}_{timeframe}.npy"
+        return self.directory / exchange.lower() / file_name
+
+    def read(self, exchange: str, pair: str, timeframe: str) -> np.ndarray:
+        path = self.get_path(exchange, pair, timeframe)
+        try:
+            return np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return np.empty((0, COLUMN_AMOUNT), dtype=np.float64)
+
+    def write(self, exchange: str, pair: str, timeframe: str, candles: np.ndarray):
+        path = self.get_path(exchange, pair, timeframe)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "wb") as file:
+            np.save(file, candles[-MAX_CACHED_CANDLES:])
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def merge(cached: np.ndarray, new_rows: list) -> np.ndarray:
+        new_candles = np.asarray(new_rows, dtype=np.float64).reshape(-1, COLUMN_AMOUNT)
+        if not len(new_candles):
+            return np.asarray(cached)
+        kept = cached[cached[:, 0] < new_candles[0, 0]]
+        return np.concatenate([kept, new_candles])
+
+    async def fetch(
+        self,
+        fetch_ohlcv,
+        exchange: str,
+        pair: str,
+        timeframe: str,
+        limit: int = 300,
+    ) -> list:
+        """
+        Latest `limit` candles, topped up through the async `fetch_ohlcv(symbol,
+        timeframe, since, limit)` callable
+        """
+        cached = self.read(exchange, pair, timeframe)
+        timeframe_ms = ccxt.Exchange.parse_timeframe(timeframe) * 1000
+        since = int(cached[-1, 0]) if len(cached) else None
+        if since is not None and (time.time() * 1000 - since) / timeframe_ms >= limit:
+            # too far behind for one top-up request, start over from the latest
+            cached, since = cached[:0], None
+        new_rows = await fetch_ohlcv(
+            symbol=pair, timeframe=timeframe, since=since, limit=limit
+        )
+        candles = self.merge(cached, new_rows)
+        # the memory map has to be released before the file can be replaced
+        del cached
+        if len(new_rows):
+            self.write(exchange, pair, timeframe, candles)
+        return [[int(row[0]), *row[1:]] for row in candles[-limit:].tolist()]
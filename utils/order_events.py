@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+from datetime import datetime as dt
+
+import redis
+import redis.asyncio
+
+from utils import helpers
+
+ORDER_EVENTS_CHANNEL = "order_events"
+ORDER_EVENTS_REDIS_URL = os.getenv("ORDER_EVENTS_REDIS_URL", "redis://localhost:6379/0")
+NEW_ORDER = "new"
+CANCELLED_ORDER = "cancelled"
+LOG = helpers.get_logger("order_events")
+
+
+def to_event_record(order: dict) -> dict:
+    """
+    Order as stored in the fill engine's Redis keys, timestamps in unix seconds
+    """
+    return {
+        key: int(value.timestamp()) if isinstance(value, dt) else value
+        for key, value in order.items()
+    }
+
+
+def encode_event(event_type: str, order: dict) -> str:
+    return json.dumps(dict(type=event_type, order=to_event_record(order)))
+
+
+class RedisOrderEvents:
+    """
+    Order changes published by the API on a Redis pub/sub channel, as
+    {"type": "new" | "cancelled", "order": {...}}. Publishing is blocking, as Django
+    may run each async view on its own event loop, listening is async.
+    """
+
+    def __init__(
+        self,
+        redis_url: str = ORDER_EVENTS_REDIS_URL,
+        channel: str = ORDER_EVENTS_CHANNEL,
+    ):
+        self.redis_url = redis_url
+        self.channel = channel
+        self.client = redis.Redis.from_url(redis_url)
+
+    def publish(self, event_type: str, order: dict):
+        try:
+            self.client.publish(self.channel, encode_event(event_type, order))
+        except redis.RedisError as e:
+            LOG.error(f"Order {order.get('order_id')} event not published: {e}")
+
+    async def listen(self, subscribed: asyncio.Event = None):
+        """
+        Yields the events published once subscribed, `subscribed` being set then
+        """
+        client = redis.asyncio.Redis.from_url(self.redis_url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(self.channel)
+        if subscribed is not None:
+            subscribed.set()
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield json.loads(message["data"])
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+class LocalOrderEvents:
+    """
+    In-process stand-in for RedisOrderEvents, delivering each event to every
+    running listener, whichever thread publishes it
+    """
+
+    def __init__(self):
+        self.listeners = list()
+
+    def publish(self, event_type: str, order: dict):
+        message = encode_event(event_type, order)
+        for loop, queue in list(self.listeners):
+            loop.call_soon_threadsafe(queue.put_nowait, json.loads(message))
+
+    async def listen(self, subscribed: asyncio.Event = None):
+        listener = (asyncio.get_running_loop(), asyncio.Queue())
+        self.listeners.append(listener)
+        if subscribed is not None:
+            subscribed.set()
+        try:
+            while True:
+                yield await listener[1].get()
+        finally:
+            self.listeners.remove(listener)
+
+
+order_events = RedisOrderEvents()